@@ -0,0 +1,75 @@
+"""Micro-benchmark da classificação de tipo de citação
+
+Mede o custo de classificar 100 mil volumes sintéticos com as regras
+compiladas, linha a linha (identificar_tipo_citacao, como nas buscas) e
+em lote (MotorClassificacao.classificar_volumes), e confere que os dois
+caminhos concordam. Imprime o resultado em JSON.
+
+Uso: python benchmarks/bench_classificacao.py [--linhas 100000]
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pandas as pd
+
+from main import identificar_tipo_citacao, motor_classificacao
+
+TITULOS = [
+    'Introdução à economia', 'Tese de doutorado em física', 'Capítulo 3: métodos numéricos',
+    'Revista brasileira de educação', 'Dissertação de mestrado em direito', 'Cálculo volume 1',
+    'A chapter on graph theory', 'Fundamentos de administração', 'Monografia sobre saneamento',
+]
+DESCRICOES = ['', 'Livro-texto para cursos de graduação', 'Based on the doctoral thesis of the author',
+              'Coletânea de artigos', 'Trabalho de conclusão de curso apresentado em 2019']
+CATEGORIAS = [[], ['Education'], ['Journal of Economics'], ['Law', 'Revista'], ['Computers']]
+
+def gerar_volumes(linhas, semente=42):
+    aleatorio = random.Random(semente)
+    return [
+        {
+            'title': aleatorio.choice(TITULOS),
+            'description': aleatorio.choice(DESCRICOES),
+            'categories': aleatorio.choice(CATEGORIAS),
+            'pageCount': aleatorio.choice([0, 12, 30, 48, 120, 350]),
+        }
+        for _ in range(linhas)
+    ]
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--linhas', type=int, default=100_000)
+    args = parser.parse_args()
+    
+    volumes = gerar_volumes(args.linhas)
+    
+    inicio = time.perf_counter()
+    por_linha = [identificar_tipo_citacao(volume) for volume in volumes]
+    tempo_por_linha = time.perf_counter() - inicio
+    
+    df = pd.DataFrame({
+        'titulo': [v['title'] for v in volumes],
+        'descricao': [v['description'] for v in volumes],
+        'categorias': [', '.join(v['categories']) for v in volumes],
+        'paginas': [v['pageCount'] for v in volumes],
+    })
+    inicio = time.perf_counter()
+    em_lote = motor_classificacao.classificar_volumes(df['titulo'], df['descricao'], df['categorias'], df['paginas'])
+    tempo_em_lote = time.perf_counter() - inicio
+    
+    fator = 100_000 / args.linhas
+    print(json.dumps({
+        'cenario': 'classificacao',
+        'linhas': args.linhas,
+        'segundos_por_100k_linha_a_linha': round(tempo_por_linha * fator, 4),
+        'segundos_por_100k_em_lote': round(tempo_em_lote * fator, 4),
+        'resultados_iguais': por_linha == em_lote.tolist(),
+    }, ensure_ascii=False, indent=2))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,300 @@
+"""Benchmark ponta a ponta do processamento de planilhas
+
+Sobe o servidor (uvicorn main:app) em um diretório temporário, com
+GOOGLE_BOOKS_URL e OPEN_LIBRARY_URL apontando para o mock local (servidor_mock.py), envia
+planilhas sintéticas (gerar_planilha.py) por /upload e acompanha /status
+até a conclusão. Cada cenário usa um servidor novo, com cache vazio:
+
+- vazao: uma tarefa; registros/s e minutos por 100 referências
+- cache: a mesma bibliografia três vezes: cache frio, cache de buscas
+  quente (URLs alteradas, sem reaproveitar linhas) e reenvio idêntico
+- concorrentes: N uploads simultâneos de planilhas sem referências em comum
+- memoria: pico de RSS do servidor em uma planilha grande
+
+O resultado de cada cenário sai em JSON (stdout e, com --saida, em arquivo)
+para comparação entre execuções.
+
+Uso: python benchmarks/bench_ponta_a_ponta.py [--cenarios vazao,cache,concorrentes,memoria]
+         [--linhas 1000] [--duplicadas 0.3] [--concorrentes 4] [--linhas-memoria 50000]
+         [--rps 50] [--latencia 0.05] [--proporcao-429 0.0] [--provedor google,openlibrary]
+         [--saida resultado.json]
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import resource
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+
+import httpx
+
+from gerar_planilha import escrever_planilha, gerar_referencias
+from servidor_mock import CAMINHO_OPEN_LIBRARY, CAMINHO_VOLUMES, iniciar_em_thread
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+CENARIOS = ['vazao', 'cache', 'concorrentes', 'memoria']
+
+def porta_livre():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+def memoria_processo(pid):
+    """(RSS atual, pico de RSS) do processo em MB, lidos de /proc; (None, None) fora do Linux"""
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            campos = dict(linha.split(':', 1) for linha in f if ':' in linha)
+    except OSError:
+        return None, None
+    return tuple(round(int(campos[c].split()[0]) / 1024, 1) for c in ('VmRSS', 'VmHWM'))
+
+def percentil(valores, p):
+    if not valores:
+        return None
+    ordenados = sorted(valores)
+    return ordenados[min(len(ordenados) - 1, int(len(ordenados) * p))]
+
+class ServidorApp:
+    """Instância do serviço em um subprocesso, com diretórios próprios"""
+
+    def __init__(self, url_mock, provedor, rps, burst, ambiente=None):
+        self.diretorio = tempfile.TemporaryDirectory(prefix='bench_bibliografia_')
+        self.porta = porta_livre()
+        self.base = f"http://127.0.0.1:{self.porta}"
+        self.env = dict(os.environ, GOOGLE_BOOKS_URL=url_mock + CAMINHO_VOLUMES,
+                        OPEN_LIBRARY_URL=url_mock + CAMINHO_OPEN_LIBRARY, PROVEDOR_METADADOS=provedor,
+                        RATE_LIMIT_RPS=str(rps), RATE_LIMIT_BURST=str(burst), **(ambiente or {}))
+        self.processo = None
+        self.rss_inicial_mb = None
+
+    async def iniciar(self, cliente):
+        self.processo = subprocess.Popen(
+            [sys.executable, '-m', 'uvicorn', 'main:app', '--app-dir', RAIZ,
+             '--host', '127.0.0.1', '--port', str(self.porta), '--log-level', 'warning'],
+            cwd=self.diretorio.name, env=self.env,
+        )
+        limite = time.monotonic() + 60
+        while time.monotonic() < limite:
+            if self.processo.poll() is not None:
+                raise RuntimeError(f"Servidor terminou ao iniciar (código {self.processo.returncode})")
+            try:
+                if (await cliente.get(f"{self.base}/health")).status_code == 200:
+                    self.rss_inicial_mb = memoria_processo(self.processo.pid)[0]
+                    return self
+            except httpx.TransportError:
+                pass
+            await asyncio.sleep(0.2)
+        raise RuntimeError("Servidor não respondeu a /health em 60s")
+
+    def parar(self):
+        """Encerra o servidor e devolve o pico de RSS em MB"""
+        pico = memoria_processo(self.processo.pid)[1]
+        self.processo.terminate()
+        try:
+            self.processo.wait(timeout=30)
+        except subprocess.TimeoutExpired:
+            self.processo.kill()
+            self.processo.wait()
+        if pico is None:
+            # Sem /proc: maior RSS entre os filhos já encerrados (KB no Linux, bytes no macOS)
+            maximo = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+            pico = round(maximo / (1024 * 1024 if sys.platform == 'darwin' else 1024), 1)
+        self.diretorio.cleanup()
+        return pico
+
+async def processar(cliente, servidor, caminho, intervalo=0.2):
+    """Envia a planilha e acompanha /status até o fim, medindo a latência das consultas"""
+    inicio = time.perf_counter()
+    with open(caminho, 'rb') as f:
+        resposta = await cliente.post(f"{servidor.base}/upload?formato=csv",
+                                      files={'file': (os.path.basename(caminho), f)})
+    resposta.raise_for_status()
+    task_id = resposta.json()['task_id']
+
+    latencias = []
+    while True:
+        t = time.perf_counter()
+        estado = (await cliente.get(f"{servidor.base}/status/{task_id}")).json()
+        latencias.append(time.perf_counter() - t)
+        if estado['status'] in ('completed', 'error'):
+            break
+        await asyncio.sleep(intervalo)
+
+    segundos = time.perf_counter() - inicio
+    if estado['status'] == 'error':
+        raise RuntimeError(f"Tarefa {task_id} falhou: {estado.get('message')}")
+    total = estado['total']
+    return {
+        'linhas': total,
+        'segundos': round(segundos, 3),
+        'registros_por_segundo': round(total / segundos, 2),
+        'minutos_por_100_referencias': round(segundos / total * 100 / 60, 3) if total else None,
+        'segundos_no_servidor': estado.get('tempos', {}).get('total'),
+        'stats': estado.get('stats'),
+        'status_p50_ms': round(percentil(latencias, 0.5) * 1000, 1),
+        'status_max_ms': round(max(latencias) * 1000, 1),
+    }
+
+class Bancada:
+    """Executa os cenários com os parâmetros da linha de comando"""
+
+    def __init__(self, args, diretorio):
+        self.args = args
+        self.diretorio = diretorio
+        self.mock, self.url_mock = iniciar_em_thread(
+            latencia=args.latencia, variacao=args.variacao, proporcao_429=args.proporcao_429,
+            retry_after=args.retry_after, proporcao_nao_encontrados=args.nao_encontrados,
+        )
+
+    def planilha(self, nome, referencias):
+        return escrever_planilha(os.path.join(self.diretorio, f"{nome}.xlsx"), referencias)
+
+    def requisicoes_mock(self):
+        return self.mock.estatisticas.resumo()
+
+    def diferenca_mock(self, antes):
+        depois = self.requisicoes_mock()
+        return {chave: depois[chave] - antes[chave] for chave in ('requisicoes', 'respostas_429')}
+
+    async def com_servidor(self, cliente, cenario, corpo):
+        """Roda `corpo(servidor)` em um servidor novo e completa o resultado com memória e mock"""
+        ambiente = {'HEDGE_ATRASO': str(self.args.hedge_atraso)} if self.args.hedge_atraso is not None else None
+        servidor = await ServidorApp(self.url_mock, self.args.provedor, self.args.rps, self.args.burst,
+                                     ambiente).iniciar(cliente)
+        antes = self.requisicoes_mock()
+        try:
+            resultado = await corpo(servidor)
+            saude = (await cliente.get(f"{servidor.base}/health")).json()
+        finally:
+            pico = servidor.parar()
+        return {
+            'cenario': cenario,
+            **resultado,
+            'upstream': self.diferenca_mock(antes),
+            'loop': saude.get('loop'),
+            'rss_inicial_mb': servidor.rss_inicial_mb,
+            'pico_rss_mb': pico,
+        }
+
+    async def vazao(self, cliente):
+        caminho = self.planilha('vazao', gerar_referencias(self.args.linhas, self.args.duplicadas, prefixo='V'))
+        return await self.com_servidor(cliente, 'vazao', lambda servidor: processar(cliente, servidor, caminho))
+
+    async def cache(self, cliente):
+        referencias = gerar_referencias(self.args.linhas, self.args.duplicadas, prefixo='C')
+        frio = self.planilha('cache_frio', referencias)
+        # URLs diferentes mudam a impressão digital das linhas, mas não a chave de busca
+        quente = self.planilha('cache_quente', [
+            dict(r, Url=f"https://exemplo.org/{i}") for i, r in enumerate(referencias)
+        ])
+
+        async def corpo(servidor):
+            fases = {}
+            for fase, caminho in (('frio', frio), ('cache_quente', quente), ('reenvio', frio)):
+                antes = self.requisicoes_mock()
+                fases[fase] = await processar(cliente, servidor, caminho)
+                fases[fase]['upstream'] = self.diferenca_mock(antes)
+            return {'fases': fases}
+
+        return await self.com_servidor(cliente, 'cache', corpo)
+
+    async def concorrentes(self, cliente):
+        n = self.args.concorrentes
+        caminhos = [
+            self.planilha(f"concorrente_{i}", gerar_referencias(
+                self.args.linhas, self.args.duplicadas, prefixo=f"N{i}", semente=i))
+            for i in range(n)
+        ]
+
+        async def corpo(servidor):
+            inicio = time.perf_counter()
+            tarefas = await asyncio.gather(*(processar(cliente, servidor, c) for c in caminhos))
+            segundos = time.perf_counter() - inicio
+            linhas = sum(t['linhas'] for t in tarefas)
+            return {
+                'uploads': n,
+                'linhas': linhas,
+                'segundos': round(segundos, 3),
+                'registros_por_segundo': round(linhas / segundos, 2),
+                'tarefa_mais_rapida_s': min(t['segundos'] for t in tarefas),
+                'tarefa_mais_lenta_s': max(t['segundos'] for t in tarefas),
+                'status_max_ms': max(t['status_max_ms'] for t in tarefas),
+                'tarefas': tarefas,
+            }
+
+        return await self.com_servidor(cliente, 'concorrentes', corpo)
+
+    async def memoria(self, cliente):
+        caminho = self.planilha('memoria', gerar_referencias(
+            self.args.linhas_memoria, self.args.duplicadas_memoria, prefixo='M'))
+        return await self.com_servidor(cliente, 'memoria', lambda servidor: processar(cliente, servidor, caminho))
+
+def ambiente(args):
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=RAIZ,
+                                capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        'data': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+        'commit': commit,
+        'python': platform.python_version(),
+        'plataforma': platform.platform(),
+        'cpus': os.cpu_count(),
+        'parametros': {chave: valor for chave, valor in vars(args).items() if chave != 'saida'},
+    }
+
+async def executar(args):
+    resultado = {'ambiente': ambiente(args), 'cenarios': []}
+    with tempfile.TemporaryDirectory(prefix='bench_planilhas_') as diretorio:
+        bancada = Bancada(args, diretorio)
+        try:
+            async with httpx.AsyncClient(timeout=120) as cliente:
+                for cenario in args.cenarios:
+                    print(f"Executando cenário {cenario}...", file=sys.stderr)
+                    resultado['cenarios'].append(await getattr(bancada, cenario)(cliente))
+        finally:
+            bancada.mock.shutdown()
+    return resultado
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--cenarios', default=','.join(CENARIOS),
+                        type=lambda valor: [c.strip() for c in valor.split(',') if c.strip()])
+    parser.add_argument('--linhas', type=int, default=1000, help='linhas por planilha (vazao, cache, concorrentes)')
+    parser.add_argument('--duplicadas', type=float, default=0.3, help='fração de linhas repetidas')
+    parser.add_argument('--concorrentes', type=int, default=4, help='uploads simultâneos')
+    parser.add_argument('--linhas-memoria', type=int, default=50_000)
+    parser.add_argument('--duplicadas-memoria', type=float, default=0.99)
+    parser.add_argument('--rps', type=float, default=50.0, help='RATE_LIMIT_RPS do servidor')
+    parser.add_argument('--burst', type=int, default=10, help='RATE_LIMIT_BURST do servidor')
+    parser.add_argument('--latencia', type=float, default=0.05, help='latência do mock, em segundos')
+    parser.add_argument('--variacao', type=float, default=0.02, help='variação (±) da latência do mock')
+    parser.add_argument('--proporcao-429', type=float, default=0.0, help='fração de respostas 429 do mock')
+    parser.add_argument('--retry-after', type=int, default=1)
+    parser.add_argument('--nao-encontrados', type=float, default=0.1, help='fração de consultas sem resultado')
+    parser.add_argument('--provedor', default='google',
+                        help='PROVEDOR_METADADOS do servidor (ex.: google,openlibrary para buscas escalonadas)')
+    parser.add_argument('--hedge-atraso', type=float, help='HEDGE_ATRASO do servidor, em segundos')
+    parser.add_argument('--saida', help='arquivo JSON para gravar o resultado')
+    args = parser.parse_args()
+
+    desconhecidos = set(args.cenarios) - set(CENARIOS)
+    if desconhecidos:
+        parser.error(f"cenários desconhecidos: {', '.join(sorted(desconhecidos))}")
+
+    resultado = asyncio.run(executar(args))
+    texto = json.dumps(resultado, ensure_ascii=False, indent=2)
+    if args.saida:
+        with open(args.saida, 'w', encoding='utf-8') as f:
+            f.write(texto)
+    print(texto)
+
+if __name__ == '__main__':
+    main()
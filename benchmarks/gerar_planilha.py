@@ -0,0 +1,81 @@
+"""Gerador de planilhas "Bibliografia" sintéticas
+
+Gera referências com título, autor e URL, com uma proporção configurável de
+linhas duplicadas (a mesma referência repetida em outras linhas) e de leis,
+e grava a planilha "Bibliografia" no formato aceito por /upload. O resultado
+é determinístico para a mesma semente.
+
+Uso: python benchmarks/gerar_planilha.py saida.xlsx [--linhas 1000]
+         [--duplicadas 0.3] [--leis 0.02] [--prefixo A] [--semente 42]
+"""
+import argparse
+import random
+
+from openpyxl import Workbook
+
+COLUNAS = ['Título', 'Autor', 'Url']
+
+ASSUNTOS = ['economia', 'direito constitucional', 'cálculo', 'administração', 'física', 'estatística',
+            'sociologia', 'engenharia de software', 'contabilidade', 'saneamento', 'marketing', 'biologia']
+FORMAS = ['Introdução à {}', 'Fundamentos de {}', 'Manual de {}', 'Tese de doutorado em {}',
+          'Dissertação de mestrado em {}', 'Capítulo 3: {} aplicada', 'Revista brasileira de {}',
+          'Tópicos avançados em {}', '{}: teoria e prática']
+SOBRENOMES = ['Silva', 'Souza', 'Oliveira', 'Pereira', 'Costa', 'Rodrigues', 'Almeida', 'Lima', 'Gomes']
+NOMES = ['Ana', 'Bruno', 'Carla', 'Daniel', 'Eduarda', 'Felipe', 'Gabriela', 'Hugo']
+TIPOS_LEI = ['Lei', 'Lei complementar', 'Decreto', 'Decreto-lei']
+
+def gerar_referencias(linhas, duplicadas=0.3, leis=0.02, prefixo='', semente=42):
+    """Lista de `linhas` referências (dicionários), das quais a fração `duplicadas` repete outras
+
+    `prefixo` entra em todos os títulos, para gerar planilhas sem referências em comum.
+    """
+    aleatorio = random.Random(semente)
+    unicas = max(1, round(linhas * (1 - duplicadas)))
+
+    referencias = []
+    for i in range(unicas):
+        if aleatorio.random() < leis:
+            ano = aleatorio.randint(1960, 2024)
+            titulo = f"{aleatorio.choice(TIPOS_LEI)} nº {aleatorio.randint(1, 15000)}, de {ano}"
+            autor = 'Brasil'
+            url = f"https://www.planalto.gov.br/ccivil_03/leis/{prefixo}{i}.htm"
+        else:
+            assunto = aleatorio.choice(ASSUNTOS)
+            titulo = f"{prefixo} {aleatorio.choice(FORMAS).format(assunto)} {i}".strip()
+            autor = f"{aleatorio.choice(SOBRENOMES).upper()}, {aleatorio.choice(NOMES)}"
+            url = None
+        referencias.append({'Título': titulo, 'Autor': autor, 'Url': url})
+
+    originais = list(referencias)
+    referencias.extend(dict(aleatorio.choice(originais)) for _ in range(linhas - unicas))
+    aleatorio.shuffle(referencias)
+    return referencias
+
+def escrever_planilha(caminho, referencias, sheet_name='Bibliografia'):
+    """Grava as referências na planilha `sheet_name`, em modo de escrita contínua"""
+    wb = Workbook(write_only=True)
+    ws = wb.create_sheet(sheet_name)
+    ws.append(COLUNAS)
+    for referencia in referencias:
+        ws.append([referencia.get(coluna) for coluna in COLUNAS])
+    wb.save(caminho)
+    return caminho
+
+def gerar_planilha(caminho, linhas, duplicadas=0.3, leis=0.02, prefixo='', semente=42):
+    return escrever_planilha(caminho, gerar_referencias(linhas, duplicadas, leis, prefixo, semente))
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('saida')
+    parser.add_argument('--linhas', type=int, default=1000)
+    parser.add_argument('--duplicadas', type=float, default=0.3, help='fração de linhas repetidas (0 a 1)')
+    parser.add_argument('--leis', type=float, default=0.02, help='fração de referências que são leis')
+    parser.add_argument('--prefixo', default='')
+    parser.add_argument('--semente', type=int, default=42)
+    args = parser.parse_args()
+
+    gerar_planilha(args.saida, args.linhas, args.duplicadas, args.leis, args.prefixo, args.semente)
+    print(f"{args.linhas} linhas gravadas em {args.saida}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,197 @@
+"""Substituto local do endpoint de volumes do Google Books
+
+Responde a /books/v1/volumes?q=... com volumes sintéticos determinísticos
+(derivados da consulta), com latência configurável e injeção de respostas
+429 com Retry-After, para medir o pipeline sem depender da rede nem da
+cota da API. /search.json?title=...&author=... responde o mesmo volume no
+formato da Open Library, para exercitar as buscas com vários provedores.
+GET /_estatisticas devolve os contadores em JSON.
+
+Uso: python benchmarks/servidor_mock.py [--porta 8765] [--latencia 0.05]
+         [--variacao 0.02] [--proporcao-429 0.05] [--proporcao-nao-encontrados 0.1]
+
+No servidor, aponte GOOGLE_BOOKS_URL para http://127.0.0.1:<porta>/books/v1/volumes
+(e OPEN_LIBRARY_URL para http://127.0.0.1:<porta>/search.json).
+"""
+import argparse
+import hashlib
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+CAMINHO_VOLUMES = '/books/v1/volumes'
+CAMINHO_OPEN_LIBRARY = '/search.json'
+
+EDITORAS = ['Atlas', 'Saraiva', 'Elsevier', 'Pearson', 'Bookman', 'Springer', 'Cengage']
+CATEGORIAS = [['Education'], ['Business & Economics'], ['Law'], ['Computers'], ['Science'], []]
+
+class EstatisticasMock:
+    """Contadores das requisições atendidas pelo servidor mock"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.requisicoes = 0
+        self.respostas_429 = 0
+        self.nao_encontrados = 0
+        self.consultas = set()
+
+    def registrar(self, consulta, status, encontrado):
+        with self._lock:
+            self.requisicoes += 1
+            self.consultas.add(consulta)
+            if status == 429:
+                self.respostas_429 += 1
+            elif not encontrado:
+                self.nao_encontrados += 1
+
+    def resumo(self):
+        with self._lock:
+            return {
+                'requisicoes': self.requisicoes,
+                'respostas_429': self.respostas_429,
+                'nao_encontrados': self.nao_encontrados,
+                'consultas_distintas': len(self.consultas),
+            }
+
+def gerar_volume(consulta):
+    """Volume sintético, sempre o mesmo para a mesma consulta"""
+    aleatorio = random.Random(hashlib.sha1(consulta.encode('utf-8')).hexdigest())
+    titulo = consulta.split('inauthor:')[0].replace('intitle:', '').strip() or 'Sem título'
+    isbn = '978' + ''.join(str(aleatorio.randint(0, 9)) for _ in range(10))
+    return {
+        'volumeInfo': {
+            'title': titulo,
+            'subtitle': aleatorio.choice(['', 'teoria e prática', 'uma introdução']),
+            'authors': [aleatorio.choice(['Silva, A.', 'Souza, B.', 'Costa, C.', 'Lima, D.'])],
+            'publisher': aleatorio.choice(EDITORAS),
+            'publishedDate': str(aleatorio.randint(1980, 2024)),
+            'pageCount': aleatorio.choice([0, 48, 120, 240, 480]),
+            'categories': aleatorio.choice(CATEGORIAS),
+            'language': aleatorio.choice(['pt', 'en']),
+            'printType': 'BOOK',
+            'industryIdentifiers': [{'type': 'ISBN_13', 'identifier': isbn}],
+        },
+        'saleInfo': {'isEbook': aleatorio.random() < 0.2},
+    }
+
+def documento_open_library(volume):
+    """O volume sintético no formato de um documento da pesquisa da Open Library"""
+    info = volume['volumeInfo']
+    return {
+        'title': info['title'],
+        'subtitle': info['subtitle'],
+        'author_name': info['authors'],
+        'isbn': [i['identifier'] for i in info['industryIdentifiers']],
+        'publisher': [info['publisher']],
+        'first_publish_year': int(info['publishedDate']),
+        'number_of_pages_median': info['pageCount'] or None,
+        'subject': info['categories'],
+        'language': [info['language']],
+    }
+
+def criar_servidor(porta=0, latencia=0.05, variacao=0.0, proporcao_429=0.0, retry_after=1,
+                   proporcao_nao_encontrados=0.1, semente=42):
+    """Cria o servidor (sem iniciá-lo); `servidor.estatisticas` guarda os contadores
+
+    `porta=0` escolhe uma porta livre, disponível em `servidor.server_address`.
+    """
+    aleatorio = random.Random(semente)
+    lock_aleatorio = threading.Lock()
+    estatisticas = EstatisticasMock()
+
+    class Manipulador(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def responder(self, status, corpo, cabecalhos=None):
+            dados = json.dumps(corpo).encode('utf-8')
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(dados)))
+            for nome, valor in (cabecalhos or {}).items():
+                self.send_header(nome, valor)
+            self.end_headers()
+            self.wfile.write(dados)
+
+        def do_GET(self):
+            url = urlparse(self.path)
+            if url.path == '/_estatisticas':
+                self.responder(200, estatisticas.resumo())
+                return
+            parametros = parse_qs(url.query)
+            if url.path == CAMINHO_VOLUMES:
+                consulta = parametros.get('q', [''])[0]
+            elif url.path == CAMINHO_OPEN_LIBRARY:
+                # Mesma consulta que o Google montaria, para o volume sintético ser o mesmo
+                consulta = 'intitle:' + parametros.get('title', [''])[0]
+                if 'author' in parametros:
+                    consulta += ' inauthor:' + parametros['author'][0]
+            else:
+                self.responder(404, {'error': {'code': 404, 'message': 'Not Found'}})
+                return
+
+            with lock_aleatorio:
+                espera = max(0.0, latencia + aleatorio.uniform(-variacao, variacao))
+                limitado = aleatorio.random() < proporcao_429
+            time.sleep(espera)
+
+            if limitado:
+                estatisticas.registrar(consulta, 429, False)
+                self.responder(429, {'error': {'code': 429, 'message': 'Rate Limit Exceeded'}},
+                               {'Retry-After': str(retry_after)})
+                return
+
+            # "Não encontrado" também é determinístico por consulta, como na API real
+            sorteio = int(hashlib.sha1(consulta.encode('utf-8')).hexdigest()[:8], 16) / 0xFFFFFFFF
+            encontrado = sorteio >= proporcao_nao_encontrados
+            estatisticas.registrar(consulta, 200, encontrado)
+            if url.path == CAMINHO_OPEN_LIBRARY:
+                documentos = [documento_open_library(gerar_volume(consulta))] if encontrado else []
+                self.responder(200, {'numFound': len(documentos), 'docs': documentos})
+            elif encontrado:
+                self.responder(200, {'kind': 'books#volumes', 'totalItems': 1, 'items': [gerar_volume(consulta)]})
+            else:
+                self.responder(200, {'kind': 'books#volumes', 'totalItems': 0})
+
+        def log_message(self, *args):
+            pass
+
+    servidor = ThreadingHTTPServer(('127.0.0.1', porta), Manipulador)
+    servidor.daemon_threads = True
+    servidor.estatisticas = estatisticas
+    return servidor
+
+def iniciar_em_thread(**opcoes):
+    """Inicia o servidor em uma thread daemon e devolve (servidor, url_base)
+
+    As URLs dos provedores são url_base + CAMINHO_VOLUMES e url_base + CAMINHO_OPEN_LIBRARY.
+    """
+    servidor = criar_servidor(**opcoes)
+    threading.Thread(target=servidor.serve_forever, daemon=True).start()
+    host, porta = servidor.server_address[:2]
+    return servidor, f"http://{host}:{porta}"
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--porta', type=int, default=8765)
+    parser.add_argument('--latencia', type=float, default=0.05, help='segundos por resposta')
+    parser.add_argument('--variacao', type=float, default=0.0, help='variação uniforme (±) da latência')
+    parser.add_argument('--proporcao-429', type=float, default=0.0)
+    parser.add_argument('--retry-after', type=int, default=1)
+    parser.add_argument('--proporcao-nao-encontrados', type=float, default=0.1)
+    args = parser.parse_args()
+
+    servidor = criar_servidor(args.porta, args.latencia, args.variacao, args.proporcao_429,
+                              args.retry_after, args.proporcao_nao_encontrados)
+    print(f"Mock do Google Books em http://127.0.0.1:{args.porta}{CAMINHO_VOLUMES}")
+    try:
+        servidor.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        print(json.dumps(servidor.estatisticas.resumo(), ensure_ascii=False))
+
+if __name__ == '__main__':
+    main()
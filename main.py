@@ -1,24 +1,62 @@
 # main.py
-from fastapi import FastAPI, File, UploadFile, BackgroundTasks, HTTPException
-from fastapi.responses import FileResponse, HTMLResponse
+from fastapi import FastAPI, File, UploadFile, HTTPException
+from fastapi.responses import FileResponse, HTMLResponse, PlainTextResponse, StreamingResponse
 from fastapi.staticfiles import StaticFiles
 from fastapi.middleware.cors import CORSMiddleware
 import pandas as pd
-import requests
+import openpyxl
+import aiofiles
+import httpx
+import random
 import time
 import re
 import os
 import uuid
 from datetime import datetime
 from urllib.parse import quote
+from email.utils import parsedate_to_datetime
 import json
+import hashlib
+import csv
+import difflib
 import warnings
 import asyncio
-from typing import Optional
+import sqlite3
+import unicodedata
+import threading
+import socket
+import multiprocessing
+import itertools
+import queue
+import glob
+import cProfile
+import importlib.util
+import contextvars
+import functools
+from concurrent.futures import ThreadPoolExecutor
+from contextvars import ContextVar
+from collections import deque
+from typing import List, Optional
+from pydantic import BaseModel
+from contextlib import asynccontextmanager, contextmanager
+from io import StringIO
 
 warnings.simplefilter(action='ignore', category=FutureWarning)
 
-app = FastAPI(title="Processador de Bibliografia", version="1.0.0")
+@asynccontextmanager
+async def lifespan(app):
+    """Inicia e encerra o consumidor da fila de tarefas junto com a API"""
+    await em_executor(preparar_dados)
+    await iniciar_consumidor()
+    revalidacao = asyncio.create_task(revalidar_falhas())
+    monitor = asyncio.create_task(monitor_loop.executar())
+    yield
+    monitor.cancel()
+    revalidacao.cancel()
+    await parar_consumidor()
+    await fechar_cliente_http()
+
+app = FastAPI(title="Processador de Bibliografia", version="1.0.0", lifespan=lifespan)
 
 # Configurar CORS
 app.add_middleware(
@@ -34,22 +72,765 @@ UPLOAD_DIR = "uploads"
 PROCESSED_DIR = "processed"
 CACHE_DIR = "cache"
 
+# Limites de consulta à API do Google Books
+RATE_LIMIT_RPS = float(os.getenv("RATE_LIMIT_RPS", "1.0"))
+RATE_LIMIT_BURST = int(os.getenv("RATE_LIMIT_BURST", "5"))
+MAX_CONCORRENCIA = int(os.getenv("MAX_CONCORRENCIA", "8"))
+
+# Cliente HTTP compartilhado: retentativas com backoff e disjuntor (circuit breaker)
+HTTP_TIMEOUT = float(os.getenv("HTTP_TIMEOUT", "10"))
+MAX_TENTATIVAS = int(os.getenv("MAX_TENTATIVAS", "4"))
+BACKOFF_BASE = float(os.getenv("BACKOFF_BASE", "0.5"))
+BACKOFF_MAXIMO = float(os.getenv("BACKOFF_MAXIMO", "30"))
+DISJUNTOR_FALHAS = int(os.getenv("DISJUNTOR_FALHAS", "5"))
+DISJUNTOR_TEMPO_ABERTO = float(os.getenv("DISJUNTOR_TEMPO_ABERTO", "30"))
+
+# Provedor de metadados: "google", "openlibrary", "replay" (somente fixtures) ou "gravar"
+# (Google + grava fixtures). Uma lista separada por vírgulas ("google,openlibrary") consulta
+# os provedores em paralelo escalonado: o seguinte é acionado após HEDGE_ATRASO segundos.
+PROVEDOR_METADADOS = os.getenv("PROVEDOR_METADADOS", "google")
+GOOGLE_BOOKS_URL = os.getenv("GOOGLE_BOOKS_URL", "https://www.googleapis.com/books/v1/volumes")
+OPEN_LIBRARY_URL = os.getenv("OPEN_LIBRARY_URL", "https://openlibrary.org/search.json")
+HEDGE_ATRASO = float(os.getenv("HEDGE_ATRASO", "1.5"))
+FIXTURES_DIR = os.getenv("FIXTURES_DIR", os.path.join("fixtures", "google_books"))
+
+# Leitura/escrita das planilhas em lotes de linhas, com memória constante
+TAMANHO_LOTE = int(os.getenv("TAMANHO_LOTE", "500"))
+TAMANHO_BLOCO_UPLOAD = 1024 * 1024
+
+# Tarefas persistentes, com checkpoint a cada lote processado
+TAREFAS_DB = os.getenv("TAREFAS_DB", os.path.join(CACHE_DIR, "tarefas.db"))
+# Balde de tokens das buscas externas, compartilhado entre processos (arquivo próprio,
+# para não disputar o lock de escrita com os checkpoints das tarefas)
+LIMITE_TAXA_DB = os.getenv("LIMITE_TAXA_DB", os.path.join(CACHE_DIR, "limite_taxa.db"))
+
+# Fila de tarefas compartilhada entre processos
+CONSUMIDOR_EMBUTIDO = os.getenv("CONSUMIDOR_EMBUTIDO", "1") == "1"
+TAREFAS_SIMULTANEAS = int(os.getenv("TAREFAS_SIMULTANEAS", "4"))
+INTERVALO_FILA = float(os.getenv("INTERVALO_FILA", "1.0"))
+TIMEOUT_TAREFA = float(os.getenv("TIMEOUT_TAREFA", "30"))
+ID_WORKER = f"{socket.gethostname()}:{os.getpid()}"
+
+# Arquivo JSON opcional com regras de classificação (sobrepõe REGRAS_CLASSIFICACAO_PADRAO)
+REGRAS_CLASSIFICACAO = os.getenv("REGRAS_CLASSIFICACAO")
+
+# Catálogo local (SQLite FTS5) consultado antes dos provedores externos
+CATALOGO_LOCAL = os.getenv("CATALOGO_LOCAL", "1") == "1"
+CATALOGO_DB = os.getenv("CATALOGO_DB", os.path.join(CACHE_DIR, "catalogo.db"))
+CATALOGO_CONFIANCA_MINIMA = float(os.getenv("CATALOGO_CONFIANCA_MINIMA", "0.85"))
+
+# Máximo de referências por requisição em /enriquecer
+MAX_REFERENCIAS_LOTE = int(os.getenv("MAX_REFERENCIAS_LOTE", "5000"))
+
+# Cache persistente de buscas
+CACHE_DB = os.getenv("CACHE_DB", os.path.join(CACHE_DIR, "cache_buscas.db"))
+CACHE_TTL = int(os.getenv("CACHE_TTL", str(90 * 24 * 3600)))
+CACHE_MAX_ENTRADAS = int(os.getenv("CACHE_MAX_ENTRADAS", "200000"))
+# TTLs curtos para "não encontrado" e para buscas que falharam (erro de rede/API)
+CACHE_TTL_NAO_ENCONTRADO = int(os.getenv("CACHE_TTL_NAO_ENCONTRADO", str(7 * 24 * 3600)))
+CACHE_TTL_FALHA = int(os.getenv("CACHE_TTL_FALHA", "900"))
+# Falhas seguidas da mesma busca antes de ela passar a "não encontrado"; o TTL dobra a cada uma
+CACHE_MAX_FALHAS = int(os.getenv("CACHE_MAX_FALHAS", "5"))
+INTERVALO_REVALIDACAO = float(os.getenv("INTERVALO_REVALIDACAO", "300"))
+# Reaproveita o resultado de linhas idênticas já enriquecidas (reenvios da mesma planilha)
+REAPROVEITAR_LINHAS = os.getenv("REAPROVEITAR_LINHAS", "1") == "1"
+REVALIDACOES_POR_RODADA = int(os.getenv("REVALIDACOES_POR_RODADA", "50"))
+PESO_REVALIDACAO = float(os.getenv("PESO_REVALIDACAO", "0.25"))
+
 # Criar diretórios se não existirem
 for directory in [UPLOAD_DIR, PROCESSED_DIR, CACHE_DIR]:
     os.makedirs(directory, exist_ok=True)
 
+# Limites (em segundos) dos buckets dos histogramas de /metrics
+LIMITES_HISTOGRAMA = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+
+def _escapar_rotulo(valor):
+    return str(valor).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+class Metrica:
+    """Série de métricas no formato de exposição do Prometheus, com rótulos opcionais
+
+    As métricas são locais ao processo: com vários workers, cada processo
+    expõe as suas e a agregação fica a cargo do Prometheus.
+    """
+    tipo = None
+
+    def __init__(self, nome, descricao, rotulos=()):
+        self.nome = nome
+        self.descricao = descricao
+        self.rotulos = tuple(rotulos)
+        self.valores = {}
+        self._lock = threading.Lock()
+
+    def _chave(self, rotulos):
+        return tuple(str(rotulos.get(r, '')) for r in self.rotulos)
+
+    def _formatar_rotulos(self, chave, extra=()):
+        pares = list(zip(self.rotulos, chave)) + list(extra)
+        if not pares:
+            return ''
+        texto = ','.join(f'{r}="{_escapar_rotulo(v)}"' for r, v in pares)
+        return '{' + texto + '}'
+
+    def remover(self, **rotulos):
+        with self._lock:
+            self.valores.pop(self._chave(rotulos), None)
+
+    def exportar(self):
+        linhas = [f"# HELP {self.nome} {self.descricao}", f"# TYPE {self.nome} {self.tipo}"]
+        with self._lock:
+            for chave, valor in sorted(self.valores.items()):
+                linhas.extend(self._exportar_serie(chave, valor))
+        return linhas
+
+    def _exportar_serie(self, chave, valor):
+        return [f"{self.nome}{self._formatar_rotulos(chave)} {valor:g}"]
+
+class Contador(Metrica):
+    tipo = 'counter'
+
+    def incrementar(self, valor=1, **rotulos):
+        chave = self._chave(rotulos)
+        with self._lock:
+            self.valores[chave] = self.valores.get(chave, 0) + valor
+
+class Medidor(Metrica):
+    tipo = 'gauge'
+
+    def definir(self, valor, **rotulos):
+        with self._lock:
+            self.valores[self._chave(rotulos)] = valor
+
+class Histograma(Metrica):
+    tipo = 'histogram'
+
+    def __init__(self, nome, descricao, rotulos=(), limites=LIMITES_HISTOGRAMA):
+        super().__init__(nome, descricao, rotulos)
+        self.limites = tuple(limites)
+
+    def observar(self, valor, **rotulos):
+        chave = self._chave(rotulos)
+        with self._lock:
+            serie = self.valores.get(chave)
+            if serie is None:
+                serie = self.valores[chave] = [[0] * len(self.limites), 0.0, 0]
+            for i, limite in enumerate(self.limites):
+                if valor <= limite:
+                    serie[0][i] += 1
+            serie[1] += valor
+            serie[2] += 1
+
+    def _exportar_serie(self, chave, serie):
+        buckets, soma, total = serie
+        linhas = [
+            f"{self.nome}_bucket{self._formatar_rotulos(chave, [('le', f'{limite:g}')])} {n}"
+            for limite, n in zip(self.limites, buckets)
+        ]
+        linhas.append(f"{self.nome}_bucket{self._formatar_rotulos(chave, [('le', '+Inf')])} {total}")
+        linhas.append(f"{self.nome}_sum{self._formatar_rotulos(chave)} {soma:g}")
+        linhas.append(f"{self.nome}_count{self._formatar_rotulos(chave)} {total}")
+        return linhas
+
+class RegistroMetricas:
+    """Conjunto de métricas expostas em /metrics"""
+
+    def __init__(self):
+        self.metricas = []
+
+    def registrar(self, metrica):
+        self.metricas.append(metrica)
+        return metrica
+
+    def exportar(self):
+        linhas = []
+        for metrica in self.metricas:
+            linhas.extend(metrica.exportar())
+        return "\n".join(linhas) + "\n"
+
+metricas = RegistroMetricas()
+metrica_latencia_upstream = metricas.registrar(Histograma(
+    "bibliografia_upstream_latencia_segundos", "Latência de cada requisição às APIs de metadados", ("destino",)))
+metrica_respostas_upstream = metricas.registrar(Contador(
+    "bibliografia_upstream_respostas_total", "Respostas das APIs de metadados por status HTTP ou erro de rede",
+    ("destino", "status")))
+metrica_cache = metricas.registrar(Contador(
+    "bibliografia_cache_consultas_total", "Consultas ao cache de buscas: acerto, falta ou negativo (sem resultado)",
+    ("resultado",)))
+metrica_buscas = metricas.registrar(Contador(
+    "bibliografia_buscas_total", "Buscas fora do cache por origem do resultado: catalogo, encontrado, nao_encontrado ou falha",
+    ("resultado",)))
+metrica_buscas_coalescidas = metricas.registrar(Contador(
+    "bibliografia_buscas_coalescidas_total", "Buscas atendidas por outra busca da mesma chave já em andamento"))
+metrica_espera_limitador = metricas.registrar(Histograma(
+    "bibliografia_limitador_espera_segundos",
+    "Tempo de espera pela vez no escalonador de buscas (fila justa e limitador de taxa)"))
+metrica_etapas = metricas.registrar(Histograma(
+    "bibliografia_etapa_duracao_segundos",
+    "Duração de cada etapa do processamento por lote: leitura, agrupamento, buscas, aplicar_alteracoes, "
+    "processar_leis, checkpoint e escrita", ("etapa",)))
+metrica_registros = metricas.registrar(Contador(
+    "bibliografia_registros_processados_total", "Registros de planilhas processados"))
+metrica_registros_por_segundo = metricas.registrar(Medidor(
+    "bibliografia_tarefa_registros_por_segundo", "Vazão das tarefas em andamento neste processo", ("task_id",)))
+metrica_vazao_tarefas = metricas.registrar(Histograma(
+    "bibliografia_tarefa_vazao_registros_por_segundo", "Vazão média das tarefas concluídas",
+    limites=(1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000, 10000)))
+metrica_atraso_loop = metricas.registrar(Histograma(
+    "bibliografia_loop_atraso_segundos", "Atraso do event loop medido a cada 100 ms",
+    limites=(0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5)))
+metrica_fila = metricas.registrar(Medidor(
+    "bibliografia_fila_tarefas", "Tarefas aguardando na fila compartilhada"))
+metrica_tarefas_ativas = metricas.registrar(Medidor(
+    "bibliografia_tarefas_ativas", "Tarefas em processamento neste processo"))
+
+def registrar_consulta_cache(encontrado, valor):
+    metrica_cache.incrementar(resultado='falta' if not encontrado else 'acerto' if valor else 'negativo')
+
+class PerfilTarefa:
+    """Tempo gasto por uma tarefa em cada etapa e em cada resultado de busca
+
+    As buscas rodam em paralelo: a soma dos tempos das buscas (e de seus
+    componentes: espera no disjuntor e no escalonador de buscas, e a
+    chamada ao provedor, que inclui o `backoff` das retentativas) pode
+    passar do tempo de parede da etapa 'buscas'.
+    """
+
+    def __init__(self):
+        self.inicio = time.monotonic()
+        self.etapas = {}
+        self.buscas = {}
+        self.componentes = {}
+
+    def registrar_etapa(self, etapa, segundos):
+        self.etapas[etapa] = self.etapas.get(etapa, 0.0) + segundos
+
+    def registrar_busca(self, resultado, segundos):
+        quantidade, total = self.buscas.get(resultado, (0, 0.0))
+        self.buscas[resultado] = (quantidade + 1, total + segundos)
+
+    def registrar_componente(self, componente, segundos):
+        self.componentes[componente] = self.componentes.get(componente, 0.0) + segundos
+
+    def resumo(self):
+        return {
+            'total': round(time.monotonic() - self.inicio, 3),
+            'etapas': {etapa: round(segundos, 3) for etapa, segundos in self.etapas.items()},
+            'buscas': {
+                resultado: {'quantidade': quantidade, 'segundos': round(segundos, 3)}
+                for resultado, (quantidade, segundos) in self.buscas.items()
+            },
+            'componentes_busca': {nome: round(segundos, 3) for nome, segundos in self.componentes.items()}
+        }
+
+# Perfil da tarefa em execução no contexto atual (herdado pelas buscas disparadas por ela)
+perfil_tarefa = ContextVar('perfil_tarefa', default=None)
+
+def registrar_etapa(etapa, segundos):
+    metrica_etapas.observar(segundos, etapa=etapa)
+    perfil = perfil_tarefa.get()
+    if perfil is not None:
+        perfil.registrar_etapa(etapa, segundos)
+
+def registrar_busca(resultado, inicio):
+    perfil = perfil_tarefa.get()
+    if perfil is not None:
+        perfil.registrar_busca(resultado, time.monotonic() - inicio)
+
+def registrar_componente(componente, segundos):
+    perfil = perfil_tarefa.get()
+    if perfil is not None:
+        perfil.registrar_componente(componente, segundos)
+
+@contextmanager
+def medir_etapa(etapa):
+    """Cronometra um trecho do processamento no histograma de etapas e no perfil da tarefa"""
+    inicio = time.monotonic()
+    try:
+        yield
+    finally:
+        registrar_etapa(etapa, time.monotonic() - inicio)
+
+def iterar_medindo(iteravel, etapa):
+    """Repassa os itens de `iteravel`, cronometrando a produção de cada um"""
+    iterador = iter(iteravel)
+    while True:
+        inicio = time.monotonic()
+        try:
+            item = next(iterador)
+        except StopIteration:
+            return
+        registrar_etapa(etapa, time.monotonic() - inicio)
+        yield item
+
+# Executor limitado para trabalho bloqueante (leitura/escrita de planilhas, pandas, SQLite em lote)
+EXECUTOR_THREADS = int(os.getenv("EXECUTOR_THREADS", "4"))
+executor_bloqueante = ThreadPoolExecutor(max_workers=EXECUTOR_THREADS, thread_name_prefix="bloqueante")
+
+# Se o contexto atual pertence à tarefa perfilada pelo cProfile
+perfilando = ContextVar('perfilando', default=False)
+
+async def em_executor(funcao, *args, **kwargs):
+    """Executa `funcao` no executor limitado, sem travar o event loop
+
+    O contexto (tarefa atual e perfil de tempos) acompanha a chamada. Só na
+    tarefa perfilada a chamada roda no próprio loop, porque o cProfile só
+    enxerga a thread em que foi ativado; as demais tarefas e requisições
+    continuam usando o executor.
+    """
+    if perfilando.get():
+        return funcao(*args, **kwargs)
+    contexto = contextvars.copy_context()
+    return await asyncio.get_running_loop().run_in_executor(
+        executor_bloqueante, functools.partial(contexto.run, funcao, *args, **kwargs)
+    )
+
+class MonitorLatenciaLoop:
+    """Mede o atraso do event loop: quanto um sleep de `intervalo` acorda depois do previsto"""
+
+    def __init__(self, intervalo=0.1, amostras=600):
+        self.intervalo = intervalo
+        self.amostras = deque(maxlen=amostras)
+
+    async def executar(self):
+        while True:
+            inicio = time.monotonic()
+            await asyncio.sleep(self.intervalo)
+            atraso = max(time.monotonic() - inicio - self.intervalo, 0.0)
+            self.amostras.append(atraso)
+            metrica_atraso_loop.observar(atraso)
+
+    def resumo(self):
+        """Percentis p50/p99 e máximo (ms) das últimas amostras"""
+        if not self.amostras:
+            return {'p50_ms': None, 'p99_ms': None, 'max_ms': None, 'amostras': 0}
+        ordenadas = sorted(self.amostras)
+        percentil = lambda p: round(ordenadas[min(int(p * len(ordenadas)), len(ordenadas) - 1)] * 1000, 2)
+        return {
+            'p50_ms': percentil(0.50),
+            'p99_ms': percentil(0.99),
+            'max_ms': round(ordenadas[-1] * 1000, 2),
+            'amostras': len(ordenadas)
+        }
+
+monitor_loop = MonitorLatenciaLoop()
+
 # Dicionário para armazenar status de processamento
 processing_status = {}
 
-# Cache global
-cache_buscas = {}
+# Eventos para acordar os streams de progresso (SSE) a cada atualização local
+eventos_progresso = {}
+
+def notificar_progresso(task_id):
+    """Acorda os streams de progresso que aguardam atualizações da tarefa"""
+    evento = eventos_progresso.pop(task_id, None)
+    if evento is not None:
+        evento.set()
+
+def _conectar_sqlite(caminho, timeout=5.0):
+    """Conexão SQLite compartilhada entre threads, em modo WAL e autocommit
+
+    Usada por todos os armazenamentos do módulo; transações explícitas
+    usam BEGIN/COMMIT, sob o lock de cada classe.
+    """
+    conn = sqlite3.connect(caminho, check_same_thread=False, isolation_level=None, timeout=timeout)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    return conn
+
+def _limitar_tabela(conn, tabela, chave, ordem, max_entradas):
+    """Acima de `max_entradas`, remove de `tabela` as linhas com menor valor em `ordem`"""
+    excedente = conn.execute(f"SELECT COUNT(*) FROM {tabela}").fetchone()[0] - max_entradas
+    if excedente > 0:
+        conn.execute(
+            f"DELETE FROM {tabela} WHERE {chave} IN (SELECT {chave} FROM {tabela} ORDER BY {ordem} LIMIT ?)",
+            (excedente,)
+        )
+
+class ArmazenamentoTarefas:
+    """Tabela de tarefas em SQLite com checkpoint dos lotes já enriquecidos
+
+    Cada lote processado é gravado junto com as estatísticas acumuladas, na
+    mesma transação. Após um reinício, a tarefa continua do último lote
+    gravado em vez de refazer as buscas desde a primeira linha.
+    """
+
+    def __init__(self, caminho):
+        self._lock = threading.Lock()
+        self.conn = _conectar_sqlite(caminho)
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS tarefas (
+                task_id TEXT PRIMARY KEY,
+                arquivo TEXT NOT NULL,
+                tamanho_lote INTEGER NOT NULL,
+                situacao TEXT NOT NULL,
+                estado TEXT NOT NULL,
+                processados INTEGER NOT NULL DEFAULT 0,
+                stats TEXT,
+                worker TEXT,
+                criado_em REAL,
+                atualizado_em REAL NOT NULL,
+                opcoes TEXT
+            )
+        """)
+        colunas = {linha[1] for linha in self.conn.execute("PRAGMA table_info(tarefas)")}
+        for coluna, tipo in (('worker', 'TEXT'), ('criado_em', 'REAL'), ('opcoes', 'TEXT')):
+            if coluna not in colunas:
+                self.conn.execute(f"ALTER TABLE tarefas ADD COLUMN {coluna} {tipo}")
+        self.conn.execute("CREATE INDEX IF NOT EXISTS idx_tarefas_situacao ON tarefas (situacao, criado_em)")
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS lotes (
+                task_id TEXT NOT NULL,
+                numero INTEGER NOT NULL,
+                dados TEXT NOT NULL,
+                PRIMARY KEY (task_id, numero)
+            )
+        """)
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS concessoes (
+                nome TEXT PRIMARY KEY,
+                dono TEXT NOT NULL,
+                expira_em REAL NOT NULL
+            )
+        """)
+
+    def criar(self, task_id, arquivo, estado, tamanho_lote=TAMANHO_LOTE, opcoes=None):
+        """Registra a tarefa; `opcoes` guarda as escolhas feitas no upload (ex.: perfilar)"""
+        agora = time.time()
+        with self._lock:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO tarefas "
+                "(task_id, arquivo, tamanho_lote, situacao, estado, criado_em, atualizado_em, opcoes) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (task_id, arquivo, tamanho_lote, estado['status'], json.dumps(estado, ensure_ascii=False), agora, agora,
+                 json.dumps(opcoes or {}))
+            )
+
+    def reivindicar(self, worker, timeout=TIMEOUT_TAREFA):
+        """Retira da fila a próxima tarefa para `worker`
+
+        Também retoma tarefas em processamento cujo worker parou de renovar
+        a reserva há mais de `timeout` segundos. Retorna (task_id, arquivo)
+        ou None se a fila estiver vazia.
+        """
+        agora = time.time()
+        with self._lock:
+            return self.conn.execute("""
+                UPDATE tarefas SET situacao = 'processing', worker = ?, atualizado_em = ?
+                WHERE task_id = (
+                    SELECT task_id FROM tarefas
+                    WHERE situacao = 'queued' OR (situacao = 'processing' AND atualizado_em < ?)
+                    ORDER BY criado_em LIMIT 1
+                )
+                RETURNING task_id, arquivo
+            """, (worker, agora, agora - timeout)).fetchone()
+
+    def renovar(self, task_ids):
+        """Renova a reserva das tarefas em andamento deste worker"""
+        if not task_ids:
+            return
+        with self._lock:
+            self.conn.executemany(
+                "UPDATE tarefas SET atualizado_em = ? WHERE task_id = ? AND situacao = 'processing'",
+                [(time.time(), task_id) for task_id in task_ids]
+            )
+
+    def liberar(self, worker):
+        """Devolve à fila as tarefas em andamento de um worker que está parando"""
+        with self._lock:
+            self.conn.execute(
+                "UPDATE tarefas SET situacao = 'queued', worker = NULL WHERE worker = ? AND situacao = 'processing'",
+                (worker,)
+            )
+
+    def obter_concessao(self, nome, dono, duracao):
+        """Concessão exclusiva `nome` por `duracao` segundos (renovável pelo mesmo dono)
+
+        Retorna True se `dono` a detém agora: estava livre, expirada ou já era
+        sua. Serve para tarefas de fundo que devem rodar em um só processo.
+        """
+        agora = time.time()
+        with self._lock:
+            return self.conn.execute("""
+                INSERT INTO concessoes (nome, dono, expira_em) VALUES (?, ?, ?)
+                ON CONFLICT (nome) DO UPDATE SET dono = excluded.dono, expira_em = excluded.expira_em
+                WHERE concessoes.dono = excluded.dono OR concessoes.expira_em < ?
+                RETURNING dono
+            """, (nome, dono, agora + duracao, agora)).fetchone() is not None
+
+    def posicao_fila(self, task_id):
+        """Posição (1 = próxima) da tarefa na fila compartilhada, ou None se ela não está na fila"""
+        with self._lock:
+            linha = self.conn.execute("""
+                SELECT COUNT(*) FROM tarefas
+                WHERE situacao = 'queued' AND criado_em <= (
+                    SELECT criado_em FROM tarefas WHERE task_id = ? AND situacao = 'queued'
+                )
+            """, (task_id,)).fetchone()
+        return linha[0] or None
+
+    def tamanho_fila(self):
+        with self._lock:
+            return self.conn.execute("SELECT COUNT(*) FROM tarefas WHERE situacao = 'queued'").fetchone()[0]
+
+    def obter(self, task_id):
+        """Retorna a tarefa como dicionário, ou None se não existir"""
+        with self._lock:
+            linha = self.conn.execute(
+                "SELECT arquivo, tamanho_lote, estado, processados, stats, opcoes FROM tarefas WHERE task_id = ?",
+                (task_id,)
+            ).fetchone()
+            if linha is None:
+                return None
+            lotes = self.conn.execute("SELECT COUNT(*) FROM lotes WHERE task_id = ?", (task_id,)).fetchone()[0]
+        arquivo, tamanho_lote, estado, processados, stats, opcoes = linha
+        return {
+            'arquivo': arquivo,
+            'tamanho_lote': tamanho_lote,
+            'estado': json.loads(estado),
+            'processados': processados,
+            'stats': json.loads(stats) if stats else None,
+            'opcoes': json.loads(opcoes) if opcoes else {},
+            'lotes_concluidos': lotes
+        }
+
+    def salvar_estado(self, task_id, estado):
+        with self._lock:
+            self.conn.execute(
+                "UPDATE tarefas SET situacao = ?, estado = ?, atualizado_em = ? WHERE task_id = ?",
+                (estado['status'], json.dumps(estado, ensure_ascii=False), time.time(), task_id)
+            )
+
+    def salvar_lote(self, task_id, numero, df, estado, processados, stats):
+        """Checkpoint: grava o lote enriquecido e o progresso acumulado atomicamente"""
+        dados = df.to_json(orient='split', force_ascii=False)
+        with self._lock:
+            self.conn.execute("BEGIN")
+            self.conn.execute(
+                "INSERT OR REPLACE INTO lotes (task_id, numero, dados) VALUES (?, ?, ?)", (task_id, numero, dados)
+            )
+            self.conn.execute(
+                "UPDATE tarefas SET estado = ?, processados = ?, stats = ?, atualizado_em = ? WHERE task_id = ?",
+                (json.dumps(estado, ensure_ascii=False), processados, json.dumps(stats, ensure_ascii=False),
+                 time.time(), task_id)
+            )
+            self.conn.execute("COMMIT")
+
+    def carregar_lote(self, task_id, numero):
+        with self._lock:
+            dados = self.conn.execute(
+                "SELECT dados FROM lotes WHERE task_id = ? AND numero = ?", (task_id, numero)
+            ).fetchone()[0]
+        return pd.read_json(StringIO(dados), orient='split', dtype=False)
+
+    def finalizar(self, task_id, estado):
+        """Grava o estado final e descarta os checkpoints da tarefa"""
+        with self._lock:
+            self.conn.execute("BEGIN")
+            self.conn.execute("DELETE FROM lotes WHERE task_id = ?", (task_id,))
+            self.conn.execute(
+                "UPDATE tarefas SET situacao = ?, estado = ?, atualizado_em = ? WHERE task_id = ?",
+                (estado['status'], json.dumps(estado, ensure_ascii=False), time.time(), task_id)
+            )
+            self.conn.execute("COMMIT")
+
+armazenamento_tarefas = ArmazenamentoTarefas(TAREFAS_DB)
+
+# Estados de uma entrada do cache
+ENCONTRADO = 'encontrado'
+NAO_ENCONTRADO = 'nao_encontrado'
+FALHA = 'falha'
+
+class CacheBuscas:
+    """Cache de buscas em SQLite (modo WAL) com TTL por entrada e remoção LRU
+
+    Cada entrada é gravada assim que a busca termina, de modo que uma falha
+    no meio do processamento não perde as buscas já feitas. "Não
+    encontrado" e "busca falhou" são estados distintos, com TTLs próprios e
+    curtos; as falhas são revalidadas em segundo plano.
+    """
+
+    def __init__(self, caminho, ttl=CACHE_TTL, max_entradas=CACHE_MAX_ENTRADAS, max_falhas=CACHE_MAX_FALHAS):
+        self.ttl = ttl
+        self.max_falhas = max_falhas
+        self.ttls = {
+            ENCONTRADO: ttl,
+            NAO_ENCONTRADO: CACHE_TTL_NAO_ENCONTRADO,
+            FALHA: CACHE_TTL_FALHA,
+        }
+        self.max_entradas = max_entradas
+        self._lock = threading.Lock()
+        self._escritas = 0
+        self.conn = _conectar_sqlite(caminho)
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS buscas (
+                chave TEXT PRIMARY KEY,
+                valor TEXT,
+                expira_em REAL,
+                acessado_em REAL NOT NULL,
+                estado TEXT,
+                titulo TEXT,
+                autor TEXT,
+                falhas INTEGER
+            )
+        """)
+        colunas = {linha[1] for linha in self.conn.execute("PRAGMA table_info(buscas)")}
+        for coluna, tipo in (('estado', 'TEXT'), ('titulo', 'TEXT'), ('autor', 'TEXT'), ('falhas', 'INTEGER')):
+            if coluna not in colunas:
+                self.conn.execute(f"ALTER TABLE buscas ADD COLUMN {coluna} {tipo}")
+        # Entradas antigas com valor nulo misturavam "não encontrado" com erro de rede:
+        # são tratadas como falha para serem revalidadas
+        self.conn.execute(
+            "UPDATE buscas SET estado = CASE WHEN valor = 'null' THEN ? ELSE ? END WHERE estado IS NULL",
+            (FALHA, ENCONTRADO)
+        )
+        self.conn.execute("CREATE INDEX IF NOT EXISTS idx_buscas_acesso ON buscas (acessado_em)")
+        self.conn.execute("CREATE INDEX IF NOT EXISTS idx_buscas_estado ON buscas (estado, expira_em)")
+
+    def obter(self, chave):
+        """Retorna (encontrado, valor); entradas expiradas contam como ausentes
 
-# Carregar cache se existir
-try:
-    with open(f"{CACHE_DIR}/cache_buscas.json", "r", encoding="utf-8") as f:
-        cache_buscas = json.load(f)
-except:
-    pass
+        Falhas expiradas ficam na tabela até a próxima gravação da chave, para
+        a contagem de falhas seguidas (e o recuo da revalidação) não zerar.
+        """
+        agora = time.time()
+        with self._lock:
+            linha = self.conn.execute(
+                "SELECT valor, expira_em, estado FROM buscas WHERE chave = ?", (chave,)
+            ).fetchone()
+            if linha is None:
+                return False, None
+            valor, expira_em, estado = linha
+            if expira_em is not None and expira_em < agora:
+                if estado != FALHA:
+                    self.conn.execute("DELETE FROM buscas WHERE chave = ?", (chave,))
+                return False, None
+            self.conn.execute("UPDATE buscas SET acessado_em = ? WHERE chave = ?", (agora, chave))
+        return True, json.loads(valor)
+
+    def salvar(self, chave, valor, ttl=None, estado=None, titulo=None, autor=None):
+        """Grava a entrada imediatamente
+
+        `estado` padrão é ENCONTRADO ou NAO_ENCONTRADO conforme o valor, e
+        `ttl=None` usa o TTL configurado para o estado. Falhas seguidas da
+        mesma chave dobram o TTL a cada vez (a revalidação espera mais) e,
+        passadas CACHE_MAX_FALHAS, a chave fica como NAO_ENCONTRADO.
+        """
+        if estado is None:
+            estado = ENCONTRADO if valor is not None else NAO_ENCONTRADO
+        agora = time.time()
+        with self._lock:
+            falhas = 0
+            if estado == FALHA:
+                anterior = self.conn.execute(
+                    "SELECT falhas FROM buscas WHERE chave = ? AND estado = ?", (chave, FALHA)
+                ).fetchone()
+                falhas = (anterior[0] or 1) + 1 if anterior else 1
+                if falhas > self.max_falhas:
+                    estado = NAO_ENCONTRADO
+                elif ttl is None and self.ttls[FALHA]:
+                    ttl = self.ttls[FALHA] * 2 ** (falhas - 1)
+            ttl = self.ttls[estado] if ttl is None else ttl
+            expira_em = agora + ttl if ttl else None
+            self.conn.execute(
+                "INSERT OR REPLACE INTO buscas (chave, valor, expira_em, acessado_em, estado, titulo, autor, falhas) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (chave, json.dumps(valor, ensure_ascii=False), expira_em, agora, estado,
+                 None if titulo is None or pd.isna(titulo) else str(titulo),
+                 None if autor is None or pd.isna(autor) else str(autor), falhas)
+            )
+            self._escritas += 1
+            if self._escritas % 100 == 0:
+                self._remover_excedentes()
+
+    def falhas(self, limite, ate=None):
+        """Entradas em estado de falha que expiram até `ate` (padrão: todas), as mais próximas primeiro
+
+        Retorna (chave, titulo, autor); para entradas antigas sem a consulta
+        original, título e autor vêm da própria chave normalizada.
+        """
+        with self._lock:
+            linhas = self.conn.execute(
+                "SELECT chave, titulo, autor FROM buscas WHERE estado = ? AND COALESCE(expira_em, 0) <= ? "
+                "ORDER BY expira_em LIMIT ?",
+                (FALHA, float('inf') if ate is None else ate, limite)
+            ).fetchall()
+        resultado = []
+        for chave, titulo, autor in linhas:
+            if titulo is None:
+                titulo, _, autor = chave.partition('|')
+            resultado.append((chave, titulo, autor or None))
+        return resultado
+
+    def resultados_encontrados(self):
+        """Todos os resultados de buscas bem-sucedidas guardados no cache"""
+        with self._lock:
+            valores = self.conn.execute("SELECT valor FROM buscas WHERE estado = ?", (ENCONTRADO,)).fetchall()
+        for (valor,) in valores:
+            yield json.loads(valor)
+
+    def contagem_por_estado(self):
+        with self._lock:
+            return dict(self.conn.execute("SELECT estado, COUNT(*) FROM buscas GROUP BY estado").fetchall())
+
+    def _remover_excedentes(self):
+        """Remove expirados e, acima do limite, as entradas acessadas há mais tempo
+
+        Falhas expiradas ficam até a revalidação, que guarda a contagem de falhas seguidas.
+        """
+        self.conn.execute(
+            "DELETE FROM buscas WHERE expira_em IS NOT NULL AND expira_em < ? AND estado IS NOT ?",
+            (time.time(), FALHA)
+        )
+        _limitar_tabela(self.conn, 'buscas', 'chave', 'acessado_em', self.max_entradas)
+
+    def migrar_json(self, caminho_json):
+        """Importa uma única vez o antigo cache_buscas.json e o renomeia
+
+        Valores nulos do arquivo antigo podem ter sido erros de rede, então
+        entram como FALHA e passam pela revalidação.
+        """
+        if not os.path.exists(caminho_json):
+            return 0
+        try:
+            with open(caminho_json, "r", encoding="utf-8") as f:
+                dados = json.load(f)
+        except (OSError, ValueError) as e:
+            print(f"Erro ao migrar cache: {e}")
+            return 0
+        agora = time.time()
+        registros = []
+        for chave_antiga, valor in dados.items():
+            titulo, autor = self._consulta_legada(chave_antiga)
+            estado = ENCONTRADO if valor is not None else FALHA
+            expira_em = agora + self.ttls[estado] if self.ttls[estado] else None
+            registros.append((chave_busca(titulo, autor), json.dumps(valor, ensure_ascii=False),
+                              expira_em, agora, estado, titulo, autor))
+        with self._lock:
+            self.conn.execute("BEGIN")
+            self.conn.executemany(
+                "INSERT OR IGNORE INTO buscas (chave, valor, expira_em, acessado_em, estado, titulo, autor) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                registros
+            )
+            self.conn.execute("COMMIT")
+        try:
+            os.replace(caminho_json, caminho_json + ".migrado")
+        except FileNotFoundError:
+            # Outro processo migrou ao mesmo tempo; INSERT OR IGNORE torna a repetição inócua
+            pass
+        return len(dados)
+
+    @staticmethod
+    def _consulta_legada(chave):
+        """Recupera (titulo, autor) da antiga chave no formato titulo_autor"""
+        titulo, _, autor = chave.rpartition('_')
+        if not titulo:
+            titulo, autor = chave, None
+        return titulo, None if autor in ('None', 'nan') else autor
+
+    def __len__(self):
+        with self._lock:
+            return self.conn.execute("SELECT COUNT(*) FROM buscas").fetchone()[0]
 
 def limpar_texto(texto):
     """Limpa e normaliza texto"""
@@ -60,94 +841,1117 @@ def limpar_texto(texto):
     texto = re.sub(r'\s+', ' ', texto)
     return texto.strip()
 
-def buscar_info_livro(titulo, autor=None, debug=False):
-    """Busca informações detalhadas do livro incluindo ISBN e tipo de publicação"""
+def extrair_primeiro_autor(autor):
+    """Retorna o primeiro autor de uma lista separada por ';' (ou o sobrenome em 'SOBRENOME, Nome')"""
+    if autor is None or pd.isna(autor):
+        return ""
+    return limpar_texto(str(autor).split(';')[0].split(',')[0])
+
+def normalizar_chave(texto):
+    """Minúsculas e sem acentos, para comparar textos limpos"""
+    texto = unicodedata.normalize('NFKD', limpar_texto(texto).lower())
+    return ''.join(c for c in texto if not unicodedata.combining(c))
+
+def chave_busca(titulo, autor=None):
+    """Chave normalizada de uma referência: título limpo + primeiro autor
+
+    Diferenças de caixa, pontuação, acentos e dos coautores seguintes
+    resultam na mesma chave, e portanto na mesma busca.
+    """
+    return f"{normalizar_chave(titulo)}|{normalizar_chave(extrair_primeiro_autor(autor))}"
+
+# Cache global
+cache_buscas = CacheBuscas(CACHE_DB)
+
+class CacheLinhas:
+    """Resultado do enriquecimento por impressão digital da linha (mesmo banco do cache de buscas)
+
+    Guarda, para cada linha já enriquecida, as células alteradas e o tipo e
+    provedor do resultado. Um reenvio da planilha reaproveita as linhas cuja
+    impressão não mudou, sem refazer busca nem classificação.
+    """
+
+    def __init__(self, caminho, ttl=CACHE_TTL, max_entradas=CACHE_MAX_ENTRADAS):
+        self.ttl = ttl
+        self.max_entradas = max_entradas
+        self._lock = threading.Lock()
+        self._escritas = 0
+        self.conn = _conectar_sqlite(caminho)
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS linhas (
+                impressao TEXT PRIMARY KEY,
+                valor TEXT NOT NULL,
+                criado_em REAL NOT NULL
+            )
+        """)
+        self.conn.execute("CREATE INDEX IF NOT EXISTS idx_linhas_criacao ON linhas (criado_em)")
+
+    def obter_varios(self, impressoes):
+        """Retorna {impressao: valor} das impressões conhecidas e não expiradas"""
+        impressoes = list(impressoes)
+        limite = time.time() - self.ttl
+        encontrados = {}
+        with self._lock:
+            # Consulta em blocos para respeitar o limite de parâmetros do SQLite
+            for inicio in range(0, len(impressoes), 500):
+                bloco = impressoes[inicio:inicio + 500]
+                marcadores = ','.join('?' * len(bloco))
+                for impressao, valor in self.conn.execute(
+                    f"SELECT impressao, valor FROM linhas WHERE criado_em >= ? AND impressao IN ({marcadores})",
+                    [limite] + bloco
+                ):
+                    encontrados[impressao] = json.loads(valor)
+        return encontrados
+
+    def salvar_varios(self, valores):
+        """Grava {impressao: valor} em uma única transação"""
+        if not valores:
+            return
+        agora = time.time()
+        with self._lock:
+            self.conn.execute("BEGIN")
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO linhas (impressao, valor, criado_em) VALUES (?, ?, ?)",
+                [(impressao, json.dumps(valor, ensure_ascii=False, default=str), agora)
+                 for impressao, valor in valores.items()]
+            )
+            self.conn.execute("COMMIT")
+            self._escritas += 1
+            if self._escritas % 100 == 0:
+                self._remover_excedentes()
+
+    def _remover_excedentes(self):
+        """Remove expirados e, acima do limite, as entradas mais antigas"""
+        self.conn.execute("DELETE FROM linhas WHERE criado_em < ?", (time.time() - self.ttl,))
+        _limitar_tabela(self.conn, 'linhas', 'impressao', 'criado_em', self.max_entradas)
+
+cache_linhas = CacheLinhas(CACHE_DB) if REAPROVEITAR_LINHAS else None
+
+class LimitadorTaxa:
+    """Token bucket compartilhado: libera `taxa` requisições por segundo, com rajadas de até `rajada`
+
+    O balde fica em um SQLite próprio, então todos os processos que usam o
+    mesmo diretório (workers da API, consumidor embutido, `main.py worker`,
+    /enriquecer e a revalidação) dividem um único limite, qualquer que seja
+    o número de processos. O acesso ao banco roda fora do event loop.
+    """
+
+    def __init__(self, caminho, taxa, rajada, nome="google"):
+        self.taxa = taxa
+        self.rajada = rajada
+        self.nome = nome
+        self._lock = threading.Lock()
+        self.conn = _conectar_sqlite(caminho, timeout=1.0)
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS limite_taxa (
+                nome TEXT PRIMARY KEY,
+                tokens REAL NOT NULL,
+                atualizado_em REAL NOT NULL
+            )
+        """)
+        self.conn.execute("INSERT OR IGNORE INTO limite_taxa (nome, tokens, atualizado_em) VALUES (?, ?, ?)",
+                          (nome, float(rajada), time.time()))
+
+    def _retirar(self):
+        """Retira um token se houver; senão retorna quantos segundos faltam para o próximo"""
+        with self._lock:
+            try:
+                self.conn.execute("BEGIN IMMEDIATE")
+            except sqlite3.OperationalError:
+                # Outro processo segura o balde além do timeout: tenta de novo em seguida
+                return 0.05
+            try:
+                tokens, atualizado_em = self.conn.execute(
+                    "SELECT tokens, atualizado_em FROM limite_taxa WHERE nome = ?", (self.nome,)
+                ).fetchone()
+                # Relógio de parede: o monotônico não é comparável entre processos
+                agora = time.time()
+                tokens = min(self.rajada, tokens + max(agora - atualizado_em, 0.0) * self.taxa)
+                falta = 0.0
+                if tokens >= 1:
+                    tokens -= 1
+                else:
+                    falta = (1 - tokens) / self.taxa
+                self.conn.execute("UPDATE limite_taxa SET tokens = ?, atualizado_em = ? WHERE nome = ?",
+                                  (tokens, agora, self.nome))
+                self.conn.execute("COMMIT")
+            except BaseException:
+                self.conn.execute("ROLLBACK")
+                raise
+        return falta
+
+    async def adquirir(self):
+        """Aguarda até haver um token disponível e retorna o tempo de espera"""
+        inicio = time.monotonic()
+        while (falta := await asyncio.to_thread(self._retirar)) > 0:
+            await asyncio.sleep(falta)
+        return time.monotonic() - inicio
+
+    def devolver(self):
+        """Devolve um token adquirido que acabou não sendo usado"""
+        with self._lock:
+            try:
+                self.conn.execute("UPDATE limite_taxa SET tokens = MIN(?, tokens + 1) WHERE nome = ?",
+                                  (float(self.rajada), self.nome))
+            except sqlite3.OperationalError:
+                pass  # Banco ocupado: perder um token devolvido só atrasa a próxima busca
+
+limitador_taxa = LimitadorTaxa(LIMITE_TAXA_DB, RATE_LIMIT_RPS, RATE_LIMIT_BURST)
+
+class EscalonadorJusto:
+    """Fila justa ponderada (WFQ) das buscas externas entre as tarefas
+
+    Todas as buscas do processo pedem vez ao escalonador, que divide um
+    único orçamento: no máximo `limite` buscas em andamento e um token do
+    `limitador_taxa` por busca. Cada tarefa tem sua fila de pedidos e um
+    tempo virtual que avança 1/peso a cada busca liberada; quando há vaga e
+    token, a vez é da tarefa com o menor tempo virtual. Assim uma planilha
+    pequena não espera atrás de uma enorme, e sim intercala com ela.
+    """
+
+    def __init__(self, limite=MAX_CONCORRENCIA):
+        self.limite = limite
+        self.em_andamento = 0
+        self.filas = {}
+        self.tempos = {}
+        self.pesos = {}
+        self.relogio = 0.0
+        self._sinal = None
+        self._despachante = None
+
+    def definir_peso(self, tarefa, peso):
+        self.pesos[tarefa] = peso
+
+    def remover(self, tarefa):
+        """Esquece a tarefa (peso e tempo virtual) quando ela não tem mais pedidos"""
+        if not self.filas.get(tarefa):
+            self.filas.pop(tarefa, None)
+            self.tempos.pop(tarefa, None)
+            self.pesos.pop(tarefa, None)
+
+    def _iniciar(self):
+        """Inicia o despachante no event loop atual (um por loop, como o cliente HTTP)"""
+        loop = asyncio.get_running_loop()
+        if self._despachante is None or self._despachante.done() or self._despachante.get_loop() is not loop:
+            self._sinal = asyncio.Event()
+            self.em_andamento = 0
+            self._despachante = loop.create_task(self._despachar())
+
+    def _proxima(self):
+        """Tarefa com pedidos pendentes e menor tempo virtual"""
+        candidatas = []
+        for tarefa, fila in self.filas.items():
+            while fila and fila[0].done():
+                fila.popleft()
+            if fila:
+                candidatas.append((max(self.tempos.get(tarefa, 0.0), self.relogio), tarefa))
+        return min(candidatas, key=lambda item: item[0])[1] if candidatas else None
+
+    async def _despachar(self):
+        while True:
+            await self._sinal.wait()
+            self._sinal.clear()
+            while self.em_andamento < self.limite and self._proxima() is not None:
+                await limitador_taxa.adquirir()
+                # A escolha é feita depois de obter o token, com as filas atualizadas
+                tarefa = self._proxima()
+                if tarefa is None:
+                    await asyncio.to_thread(limitador_taxa.devolver)
+                    break
+                inicio = max(self.tempos.get(tarefa, 0.0), self.relogio)
+                self.relogio = inicio
+                self.tempos[tarefa] = inicio + 1 / self.pesos.get(tarefa, 1.0)
+                self.filas[tarefa].popleft().set_result(None)
+                self.em_andamento += 1
+
+    async def adquirir(self, tarefa):
+        """Aguarda a vez da `tarefa` e retorna o tempo de espera"""
+        self._iniciar()
+        inicio = time.monotonic()
+        pedido = asyncio.get_running_loop().create_future()
+        self.filas.setdefault(tarefa, deque()).append(pedido)
+        self._sinal.set()
+        try:
+            await pedido
+        except asyncio.CancelledError:
+            if pedido.done() and not pedido.cancelled():
+                self.liberar()
+            raise
+        return time.monotonic() - inicio
+
+    def liberar(self):
+        self.em_andamento -= 1
+        self._sinal.set()
+
+    def situacao(self, tarefa):
+        """Buscas da tarefa aguardando vez e sua posição entre as tarefas com pedidos (1 = próxima)"""
+        pendentes = {t: sum(1 for pedido in fila if not pedido.done()) for t, fila in self.filas.items()}
+        pendentes = {t: n for t, n in pendentes.items() if n}
+        if tarefa not in pendentes:
+            return {'buscas_aguardando': 0, 'posicao_escalonador': None}
+        ordem = sorted(pendentes, key=lambda t: max(self.tempos.get(t, 0.0), self.relogio))
+        return {'buscas_aguardando': pendentes[tarefa], 'posicao_escalonador': ordem.index(tarefa) + 1}
+
+escalonador_buscas = EscalonadorJusto(MAX_CONCORRENCIA)
+
+# Tarefa dona das buscas disparadas no contexto atual (chave do escalonador)
+tarefa_atual = ContextVar('tarefa_atual', default='avulsa')
+
+class ErroTransitorio(Exception):
+    """Falha temporária da API (429, 5xx, rede, chave/cota recusada) que persistiu após as retentativas"""
+
+class ErroResposta(Exception):
+    """Resposta de erro da API que não adianta repetir (demais 4xx) ou corpo que não é JSON"""
+
+# Chave ou cota recusada: não adianta repetir já, mas a API volta a responder depois
+STATUS_COTA = {401, 403}
+
+class DisjuntorCircuito:
+    """Circuit breaker das buscas externas
+
+    Após `limite_falhas` falhas transitórias seguidas o circuito abre e
+    quem chama `aguardar()` fica pausado por `tempo_aberto` segundos. Em
+    seguida uma única requisição de teste é liberada: se der certo o
+    circuito fecha, se falhar ele abre de novo.
+    """
+
+    def __init__(self, limite_falhas=DISJUNTOR_FALHAS, tempo_aberto=DISJUNTOR_TEMPO_ABERTO):
+        self.limite_falhas = limite_falhas
+        self.tempo_aberto = tempo_aberto
+        self.falhas = 0
+        self.aberto_ate = 0.0
+        self._testando = False
+
+    @property
+    def aberto(self):
+        return self.falhas >= self.limite_falhas
+
+    async def aguardar(self):
+        """Retorna quando uma requisição pode ser feita"""
+        while self.aberto:
+            agora = time.monotonic()
+            if agora < self.aberto_ate:
+                await asyncio.sleep(self.aberto_ate - agora)
+            elif self._testando:
+                await asyncio.sleep(0.1)
+            else:
+                self._testando = True
+                return
+
+    def registrar_sucesso(self):
+        self.falhas = 0
+        self._testando = False
+
+    def registrar_falha(self):
+        self.falhas += 1
+        self._testando = False
+        if self.aberto:
+            self.aberto_ate = time.monotonic() + self.tempo_aberto
+
+    def liberar_teste(self):
+        """Libera a vaga de teste se a requisição foi cancelada sem resultado"""
+        self._testando = False
+
+disjuntor = DisjuntorCircuito()
+
+_cliente_http = None
+
+def cliente_http():
+    """Cliente HTTP assíncrono compartilhado, com pool de conexões keep-alive"""
+    global _cliente_http
+    loop = asyncio.get_running_loop()
+    if _cliente_http is None or _cliente_http[0] is not loop:
+        cliente = httpx.AsyncClient(
+            timeout=HTTP_TIMEOUT,
+            limits=httpx.Limits(max_connections=MAX_CONCORRENCIA * 2, max_keepalive_connections=MAX_CONCORRENCIA),
+        )
+        _cliente_http = (loop, cliente)
+    return _cliente_http[1]
+
+async def fechar_cliente_http():
+    global _cliente_http
+    if _cliente_http is not None:
+        await _cliente_http[1].aclose()
+        _cliente_http = None
+
+def _tempo_retry_after(valor):
+    """Segundos indicados no cabeçalho Retry-After (número ou data HTTP)"""
+    if not valor:
+        return None
+    try:
+        return max(float(valor), 0.0)
+    except ValueError:
+        pass
+    try:
+        data = parsedate_to_datetime(valor)
+        return max((data - datetime.now(data.tzinfo)).total_seconds(), 0.0)
+    except (TypeError, ValueError):
+        return None
+
+async def requisitar_json(url):
+    """GET com retentativas em 429/5xx e erros de rede
+
+    O intervalo cresce exponencialmente (com jitter), respeitando o
+    Retry-After da resposta. Esgotadas as tentativas, levanta
+    ErroTransitorio. Só respostas 2xx com JSON válido são devolvidas:
+    401/403 (chave ou cota) levantam ErroTransitorio na hora e os demais
+    status, ou um corpo que não é JSON, levantam ErroResposta.
+    """
+    ultimo_erro = None
+    destino = httpx.URL(url).host
+    for tentativa in range(MAX_TENTATIVAS):
+        espera = None
+        inicio = time.monotonic()
+        try:
+            resposta = await cliente_http().get(url)
+            metrica_latencia_upstream.observar(time.monotonic() - inicio, destino=destino)
+            metrica_respostas_upstream.incrementar(destino=destino, status=resposta.status_code)
+            if resposta.is_success:
+                try:
+                    return resposta.json()
+                except ValueError:
+                    raise ErroResposta(f"Resposta inválida de {destino}: não é JSON")
+            if resposta.status_code in STATUS_COTA:
+                raise ErroTransitorio(f"HTTP {resposta.status_code} de {destino} (chave ou cota recusada)")
+            if resposta.status_code != 429 and resposta.status_code < 500:
+                raise ErroResposta(f"HTTP {resposta.status_code} de {destino}")
+            ultimo_erro = f"HTTP {resposta.status_code}"
+            espera = _tempo_retry_after(resposta.headers.get('Retry-After'))
+        except httpx.TransportError as e:
+            metrica_latencia_upstream.observar(time.monotonic() - inicio, destino=destino)
+            metrica_respostas_upstream.incrementar(destino=destino, status=type(e).__name__)
+            ultimo_erro = f"{type(e).__name__}: {e}"
+        
+        if tentativa + 1 < MAX_TENTATIVAS:
+            if espera is None:
+                espera = BACKOFF_BASE * 2 ** tentativa * (1 + random.random())
+            registrar_componente('backoff', min(espera, BACKOFF_MAXIMO))
+            await asyncio.sleep(min(espera, BACKOFF_MAXIMO))
+    
+    raise ErroTransitorio(ultimo_erro)
+
+def consultar_cache(titulo, autor=None):
+    """Retorna (encontrado, valor) sem acessar a rede"""
+    return cache_buscas.obter(chave_busca(titulo, autor))
+
+# Buscas externas em andamento por chave normalizada (single-flight)
+buscas_em_andamento = {}
+
+async def buscar_info_livro_async(titulo, autor=None, usar_cache=True):
+    """Busca informações detalhadas do livro incluindo ISBN e tipo de publicação
+
+    Acertos no cache retornam imediatamente, sem passar pelo limitador, e
+    em seguida é consultado o catálogo local. Nas falhas de ambos a
+    requisição aguarda a vez no escalonador de buscas. Chamadas simultâneas
+    com a mesma chave compartilham uma única resolução. Enquanto o disjuntor
+    estiver aberto a busca fica pausada e é refeita depois, em vez de virar
+    "não encontrado". Buscas que falham ficam no cache como FALHA, com TTL
+    curto, e são revalidadas em segundo plano.
+    """
     if pd.isna(titulo):
         return None
     
-    # Cache
-    cache_key = f"{titulo}_{autor}"
-    if cache_key in cache_buscas:
-        return cache_buscas[cache_key]
+    inicio = time.monotonic()
+    cache_key = chave_busca(titulo, autor)
+    if usar_cache:
+        encontrado, valor = cache_buscas.obter(cache_key)
+        registrar_consulta_cache(encontrado, valor)
+        if encontrado:
+            registrar_busca('cache' if valor else 'cache_negativo', inicio)
+            return valor
     
-    titulo_limpo = limpar_texto(titulo)
-    query_parts = [f'intitle:{quote(titulo_limpo)}']
+    # Single-flight: buscas simultâneas da mesma chave (de qualquer tarefa) esperam
+    # a mesma resolução em vez de consultar a API de novo
+    em_andamento = buscas_em_andamento.get(cache_key)
+    if em_andamento is not None and em_andamento.get_loop() is asyncio.get_running_loop():
+        metrica_buscas_coalescidas.incrementar()
+        resultado = await asyncio.shield(em_andamento)
+        registrar_busca('coalescida', inicio)
+        return dict(resultado) if resultado is not None else None
     
-    if autor and not pd.isna(autor):
-        autor_limpo = limpar_texto(autor)
-        primeiro_autor = autor_limpo.split(';')[0].split(',')[0].strip()
-        if primeiro_autor:
-            query_parts.append(f'inauthor:{quote(primeiro_autor)}')
+    # A resolução roda em uma tarefa própria: se quem a iniciou for cancelado,
+    # as outras que aguardam a mesma chave ainda recebem o resultado
+    em_andamento = asyncio.ensure_future(_resolver_busca(titulo, autor, cache_key, inicio))
+    buscas_em_andamento[cache_key] = em_andamento
+    em_andamento.add_done_callback(
+        lambda tarefa: buscas_em_andamento.pop(cache_key, None) if buscas_em_andamento.get(cache_key) is tarefa else None
+    )
+    return await asyncio.shield(em_andamento)
+
+async def _resolver_busca(titulo, autor, cache_key, inicio):
+    """Consulta o catálogo local e, se preciso, o provedor externo, gravando o resultado no cache"""
+    # Catálogo local: resolve sem rede e sem consumir a cota da API
+    if catalogo_local is not None:
+        resultado = catalogo_local.buscar(titulo, autor)
+        if resultado is not None:
+            resultado['provedor'] = 'catalogo'
+            metrica_buscas.incrementar(resultado='catalogo')
+            cache_buscas.salvar(cache_key, resultado, titulo=titulo, autor=autor)
+            registrar_busca('catalogo', inicio)
+            return resultado
     
-    query = '+'.join(query_parts)
-    url = f"https://www.googleapis.com/books/v1/volumes?q={query}&maxResults=5"
+    while True:
+        inicio_espera = time.monotonic()
+        await disjuntor.aguardar()
+        registrar_componente('disjuntor', time.monotonic() - inicio_espera)
+        estado = None
+        try:
+            espera = await escalonador_buscas.adquirir(tarefa_atual.get())
+            metrica_espera_limitador.observar(espera)
+            registrar_componente('escalonador', espera)
+            inicio_provedor = time.monotonic()
+            try:
+                resultado = await provedor_metadados.buscar(titulo, autor)
+            finally:
+                registrar_componente('provedor', time.monotonic() - inicio_provedor)
+                escalonador_buscas.liberar()
+        except ErroTransitorio as e:
+            disjuntor.registrar_falha()
+            print(f"Erro na busca: {e}")
+            if disjuntor.aberto:
+                continue
+            resultado, estado = None, FALHA
+        except asyncio.CancelledError:
+            disjuntor.liberar_teste()
+            raise
+        except Exception as e:
+            # Resposta de erro, corpo inválido ou defeito do provedor: falha, nunca "não encontrado".
+            # É um erro desta consulta, não da API: não conta para o disjuntor nem zera suas falhas
+            disjuntor.liberar_teste()
+            print(f"Erro na busca: {e}")
+            resultado, estado = None, FALHA
+        else:
+            disjuntor.registrar_sucesso()
+            if resultado is not None:
+                resultado.setdefault('provedor', provedor_metadados.nome)
+                if catalogo_local is not None:
+                    catalogo_local.adicionar([resultado])
+        
+        estado_final = estado or (ENCONTRADO if resultado is not None else NAO_ENCONTRADO)
+        metrica_buscas.incrementar(resultado=estado_final)
+        
+        # Salva no cache
+        cache_buscas.salvar(cache_key, resultado, estado=estado, titulo=titulo, autor=autor)
+        registrar_busca(estado_final, inicio)
+        return resultado
+
+async def revalidar_falhas():
+    """Refaz periodicamente as buscas que falharam, para o cache se recuperar sozinho
+
+    As revalidações têm peso menor no escalonador: cedem a vez às tarefas. Só
+    o processo que detém a concessão 'revalidacao' em tarefas.db revalida, e
+    cada chave espera o seu TTL de falha (que dobra a cada nova falha).
+    """
+    tarefa_atual.set('revalidacao')
+    escalonador_buscas.definir_peso('revalidacao', PESO_REVALIDACAO)
+    while True:
+        await asyncio.sleep(INTERVALO_REVALIDACAO)
+        if disjuntor.aberto:
+            continue
+        try:
+            # Uma só rodada por vez entre todos os processos: quem detém a concessão revalida
+            if not await em_executor(armazenamento_tarefas.obter_concessao, 'revalidacao',
+                                     ID_WORKER, 2 * INTERVALO_REVALIDACAO):
+                continue
+            # Só as que vencem antes da próxima rodada, as mais antigas primeiro
+            pendentes = cache_buscas.falhas(REVALIDACOES_POR_RODADA, time.time() + INTERVALO_REVALIDACAO)
+            for _, titulo, autor in pendentes:
+                await buscar_info_livro_async(titulo, autor, usar_cache=False)
+            if pendentes:
+                print(f"Revalidadas {len(pendentes)} buscas que haviam falhado")
+        except Exception as e:
+            print(f"Erro na revalidação do cache: {e}")
+
+async def executar_concorrente(itens, corrotina, limite):
+    """Executa `corrotina(item)` para cada item com no máximo `limite` em andamento
+
+    Gera os resultados na ordem em que ficam prontos.
+    """
+    itens = iter(itens)
+    pendentes = set()
     
-    try:
-        resposta = requests.get(url, timeout=10)
-        dados = resposta.json()
+    for item in itens:
+        pendentes.add(asyncio.ensure_future(corrotina(item)))
+        if len(pendentes) >= limite:
+            break
+    
+    while pendentes:
+        prontos, pendentes = await asyncio.wait(pendentes, return_when=asyncio.FIRST_COMPLETED)
+        for tarefa in prontos:
+            proximo = next(itens, None)
+            if proximo is not None:
+                pendentes.add(asyncio.ensure_future(corrotina(proximo)))
+            yield tarefa.result()
+
+class ProvedorMetadados:
+    """Interface dos provedores de metadados de livros
+
+    `await buscar(titulo, autor)` retorna o dicionário `resultado` usado
+    por preencher_colunas_por_tipo, ou None quando não há resultado. Falhas
+    temporárias devem ser propagadas como ErroTransitorio e respostas de
+    erro como ErroResposta, nunca como None.
+    """
+    nome = "base"
+
+    async def buscar(self, titulo, autor=None):
+        raise NotImplementedError
+
+class GoogleBooksProvedor(ProvedorMetadados):
+    """Busca na API de volumes do Google Books"""
+    nome = "google"
+
+    def __init__(self, url_base=GOOGLE_BOOKS_URL):
+        self.url_base = url_base
+
+    def montar_url(self, titulo, autor=None):
+        titulo_limpo = limpar_texto(titulo)
+        query_parts = [f'intitle:{quote(titulo_limpo)}']
         
-        if 'items' in dados and len(dados['items']) > 0:
-            for item in dados['items']:
-                volume_info = item.get('volumeInfo', {})
-                
-                isbn = None
-                for identifier in volume_info.get('industryIdentifiers', []):
-                    if identifier['type'] == 'ISBN_13':
-                        isbn = identifier['identifier']
-                        break
-                    elif identifier['type'] == 'ISBN_10':
-                        isbn = identifier['identifier']
-                
-                tipo_citacao = identificar_tipo_citacao(volume_info)
-                
-                resultado = {
-                    'isbn': isbn,
-                    'tipo_citacao': tipo_citacao,
-                    'titulo_google': volume_info.get('title', ''),
-                    'subtitulo': volume_info.get('subtitle', ''),
-                    'autores': ', '.join(volume_info.get('authors', [])),
-                    'editora': volume_info.get('publisher', ''),
-                    'ano_publicacao': volume_info.get('publishedDate', '')[:4] if volume_info.get('publishedDate') else '',
-                    'paginas': volume_info.get('pageCount', ''),
-                    'categorias': ', '.join(volume_info.get('categories', [])),
-                    'idioma': volume_info.get('language', ''),
-                    'print_type': volume_info.get('printType', ''),
-                    'is_ebook': item.get('saleInfo', {}).get('isEbook', False)
-                }
+        if autor and not pd.isna(autor):
+            primeiro_autor = extrair_primeiro_autor(autor)
+            if primeiro_autor:
+                query_parts.append(f'inauthor:{quote(primeiro_autor)}')
+        
+        query = '+'.join(query_parts)
+        return f"{self.url_base}?q={query}&maxResults=5"
+
+    async def buscar(self, titulo, autor=None):
+        return self.interpretar_resposta(await requisitar_json(self.montar_url(titulo, autor)))
+
+    @staticmethod
+    def interpretar_resposta(dados):
+        """Converte a resposta da API no dicionário `resultado` do primeiro volume"""
+        for item in dados.get('items') or []:
+            volume_info = item.get('volumeInfo', {})
+            
+            isbn = None
+            for identifier in volume_info.get('industryIdentifiers', []):
+                if identifier['type'] == 'ISBN_13':
+                    isbn = identifier['identifier']
+                    break
+                elif identifier['type'] == 'ISBN_10':
+                    isbn = identifier['identifier']
+            
+            tipo_citacao = identificar_tipo_citacao(volume_info)
+            
+            return {
+                'isbn': isbn,
+                'tipo_citacao': tipo_citacao,
+                'titulo_google': volume_info.get('title', ''),
+                'subtitulo': volume_info.get('subtitle', ''),
+                'autores': ', '.join(volume_info.get('authors', [])),
+                'editora': volume_info.get('publisher', ''),
+                'ano_publicacao': volume_info.get('publishedDate', '')[:4] if volume_info.get('publishedDate') else '',
+                'paginas': volume_info.get('pageCount', ''),
+                'categorias': ', '.join(volume_info.get('categories', [])),
+                'idioma': volume_info.get('language', ''),
+                'print_type': volume_info.get('printType', ''),
+                'is_ebook': item.get('saleInfo', {}).get('isEbook', False)
+            }
+        return None
+
+class ReplayProvedor(ProvedorMetadados):
+    """Reproduz respostas gravadas em um diretório de fixtures, sem acessar a rede
+
+    Com `gravar_de` informado, consulta esse provedor nas fixtures ausentes
+    e grava a resposta, permitindo medir o pipeline offline depois.
+    """
+    nome = "replay"
+
+    def __init__(self, diretorio=FIXTURES_DIR, gravar_de=None):
+        self.diretorio = diretorio
+        self.gravar_de = gravar_de
+        os.makedirs(diretorio, exist_ok=True)
+
+    def caminho_fixture(self, titulo, autor=None):
+        nome = hashlib.sha1(chave_busca(titulo, autor).encode("utf-8")).hexdigest()
+        return os.path.join(self.diretorio, f"{nome}.json")
+
+    async def buscar(self, titulo, autor=None):
+        caminho = self.caminho_fixture(titulo, autor)
+        if os.path.exists(caminho):
+            with open(caminho, "r", encoding="utf-8") as f:
+                return json.load(f)['resultado']
+        
+        if self.gravar_de is None:
+            return None
+        
+        resultado = await self.gravar_de.buscar(titulo, autor)
+        with open(caminho, "w", encoding="utf-8") as f:
+            json.dump({'titulo': str(titulo), 'autor': None if pd.isna(autor) else str(autor),
+                       'resultado': resultado}, f, ensure_ascii=False)
+        return resultado
+
+class OpenLibraryProvedor(ProvedorMetadados):
+    """Busca na API de pesquisa da Open Library"""
+    nome = "openlibrary"
+
+    def __init__(self, url_base=OPEN_LIBRARY_URL):
+        self.url_base = url_base
+
+    def montar_url(self, titulo, autor=None):
+        url = f"{self.url_base}?title={quote(limpar_texto(titulo))}&limit=5"
+        primeiro_autor = extrair_primeiro_autor(autor)
+        if primeiro_autor:
+            url += f"&author={quote(primeiro_autor)}"
+        return url
+
+    async def buscar(self, titulo, autor=None):
+        return self.interpretar_resposta(await requisitar_json(self.montar_url(titulo, autor)))
+
+    @staticmethod
+    def interpretar_resposta(dados):
+        """Converte a resposta da Open Library no dicionário `resultado` do primeiro documento"""
+        for doc in dados.get('docs') or []:
+            isbns = doc.get('isbn') or []
+            isbn = next((i for i in isbns if len(i) == 13), isbns[0] if isbns else None)
+            paginas = doc.get('number_of_pages_median') or ''
+            categorias = (doc.get('subject') or [])[:5]
+            
+            tipo_citacao = identificar_tipo_citacao({
+                'title': doc.get('title', ''),
+                'categories': categorias,
+                'pageCount': paginas or 0,
+            })
+            
+            return {
+                'isbn': isbn,
+                'tipo_citacao': tipo_citacao,
+                'titulo_google': doc.get('title', ''),
+                'subtitulo': doc.get('subtitle', ''),
+                'autores': ', '.join(doc.get('author_name') or []),
+                'editora': (doc.get('publisher') or [''])[0],
+                'ano_publicacao': str(doc.get('first_publish_year') or ''),
+                'paginas': paginas,
+                'categorias': ', '.join(categorias),
+                'idioma': (doc.get('language') or [''])[0],
+                'print_type': 'BOOK',
+                'is_ebook': doc.get('ebook_access') == 'public'
+            }
+        return None
+
+class ProvedorEscalonado(ProvedorMetadados):
+    """Consulta vários provedores com requisições escalonadas (hedged requests)
+
+    O primeiro provedor é consultado imediatamente; se não responder em
+    `atraso` segundos (ou responder sem resultado), o seguinte entra na
+    disputa. O primeiro resultado encontrado vence, as demais requisições
+    são canceladas e o nome do provedor vencedor fica em
+    resultado['provedor']. Se todos falharem, levanta ErroTransitorio quando
+    algum dos erros for transitório e, senão, o primeiro erro.
+    """
+
+    def __init__(self, provedores, atraso=HEDGE_ATRASO):
+        self.provedores = provedores
+        self.atraso = atraso
+        self.nome = ','.join(provedor.nome for provedor in provedores)
+
+    async def buscar(self, titulo, autor=None):
+        restantes = list(self.provedores)
+        em_andamento = {}
+        erros = []
+        try:
+            while restantes or em_andamento:
+                if restantes and not em_andamento:
+                    provedor = restantes.pop(0)
+                    em_andamento[asyncio.create_task(provedor.buscar(titulo, autor))] = provedor
                 
-                # Salva no cache
-                cache_buscas[cache_key] = resultado
-                return resultado
+                prontas, _ = await asyncio.wait(
+                    em_andamento, timeout=self.atraso if restantes else None,
+                    return_when=asyncio.FIRST_COMPLETED
+                )
+                if not prontas:
+                    # Nenhuma resposta dentro do atraso: aciona o próximo provedor
+                    provedor = restantes.pop(0)
+                    em_andamento[asyncio.create_task(provedor.buscar(titulo, autor))] = provedor
+                    continue
                 
-    except Exception as e:
-        print(f"Erro na busca: {e}")
-    
-    cache_buscas[cache_key] = None
-    return None
+                for tarefa in prontas:
+                    provedor = em_andamento.pop(tarefa)
+                    try:
+                        resultado = tarefa.result()
+                    except Exception as e:
+                        erros.append(e)
+                        continue
+                    if resultado is not None:
+                        return dict(resultado, provedor=provedor.nome)
+        finally:
+            for tarefa in em_andamento:
+                tarefa.cancel()
+        
+        if len(erros) == len(self.provedores):
+            # Todos falharam: um erro passageiro em algum deles faz a busca ser refeita depois
+            transitorios = [e for e in erros if isinstance(e, ErroTransitorio)]
+            if transitorios:
+                raise ErroTransitorio('; '.join(str(e) for e in transitorios))
+            raise erros[0]
+        return None
+
+def criar_provedor(nome):
+    """Instancia o provedor configurado em PROVEDOR_METADADOS"""
+    if ',' in nome:
+        return ProvedorEscalonado([criar_provedor(n.strip()) for n in nome.split(',') if n.strip()])
+    if nome == "google":
+        return GoogleBooksProvedor()
+    if nome == "openlibrary":
+        return OpenLibraryProvedor()
+    if nome == "replay":
+        return ReplayProvedor()
+    if nome == "gravar":
+        return ReplayProvedor(gravar_de=GoogleBooksProvedor())
+    raise ValueError(f"Provedor de metadados desconhecido: {nome}")
+
+provedor_metadados = criar_provedor(PROVEDOR_METADADOS)
+
+# Regras de classificação: cada conjunto mapeia categoria -> palavras-chave (em minúsculas,
+# comparadas como substring). Palavras de categorias do mesmo conjunto não devem se sobrepor.
+REGRAS_CLASSIFICACAO_PADRAO = {
+    'tipo_citacao': {
+        'academico': ['dissertação', 'tese', 'monografia', 'trabalho de conclusão',
+                      'tcc', 'dissertation', 'thesis', 'doctoral', 'mestrado', 'doutorado'],
+        'revista': ['journal', 'article', 'revista'],
+        'capitulo': ['capítulo', 'chapter'],
+    },
+    'tipo_trabalho': {
+        'dissertacao': ['dissertação', 'mestrado'],
+        'tese': ['tese', 'doutorado'],
+    },
+    'lei': {
+        'lei': ['lei', 'decreto', 'portaria', 'resolução', 'medida provisória',
+                'constituição', 'código', 'estatuto', 'norma', 'regulamento'],
+    },
+    'limite_paginas_artigo': 50,
+}
+
+# Categorias que o motor consulta em cada conjunto de regras
+CATEGORIAS_OBRIGATORIAS = {
+    'tipo_citacao': {'academico', 'revista', 'capitulo'},
+    'tipo_trabalho': {'dissertacao', 'tese'},
+    'lei': {'lei'},
+}
+
+# Padrão que nunca casa, para categorias desligadas com uma lista vazia
+NUNCA_CASA = '(?!)'
+
+class ConjuntoRegras:
+    """Conjunto de categorias de palavras-chave compilado uma única vez
+
+    Cada categoria vira uma alternação pré-compilada, usada tanto para textos
+    avulsos (`contem`) quanto para colunas inteiras com os métodos vetorizados
+    do pandas (`marcar`); `encontrar` usa uma única regex combinada (um grupo
+    nomeado por categoria) para achar todas as categorias de um texto de uma
+    vez. Uma categoria sem palavras-chave está desligada e nunca casa.
+    """
+
+    def __init__(self, categorias):
+        self.por_categoria = {
+            nome: re.compile('|'.join(re.escape(p.lower()) for p in palavras) if palavras else NUNCA_CASA)
+            for nome, palavras in categorias.items()
+        }
+        self.regex = re.compile('|'.join(
+            f"(?P<{nome}>{regex.pattern})" for nome, regex in self.por_categoria.items()
+        ))
+
+    def encontrar(self, texto):
+        """Categorias presentes em um texto (já em minúsculas)"""
+        return {m.lastgroup for m in self.regex.finditer(texto)}
+
+    def contem(self, texto, categoria):
+        """Se o texto (já em minúsculas) tem alguma palavra da categoria"""
+        return self.por_categoria[categoria].search(texto) is not None
+
+    def marcar(self, serie, categorias=None):
+        """DataFrame booleano (uma coluna por categoria) para uma coluna de textos em minúsculas"""
+        serie = serie.fillna('').astype(str)
+        return pd.DataFrame(
+            {nome: serie.str.contains(self.por_categoria[nome]) for nome in (categorias or self.por_categoria)},
+            index=serie.index
+        )
+
+class MotorClassificacao:
+    """Regras declarativas de tipo de citação, tipo de trabalho e leis"""
+
+    def __init__(self, regras=REGRAS_CLASSIFICACAO_PADRAO):
+        self.validar(regras)
+        self.tipo_citacao = ConjuntoRegras(regras['tipo_citacao'])
+        self.tipo_trabalho = ConjuntoRegras(regras['tipo_trabalho'])
+        self.lei = ConjuntoRegras(regras['lei'])
+        self.limite_paginas_artigo = regras['limite_paginas_artigo']
+        # Buscas pré-compiladas usadas a cada volume retornado pelas buscas (caminho quente)
+        self._busca_academico = self.tipo_citacao.por_categoria['academico'].search
+        self._busca_revista = self.tipo_citacao.por_categoria['revista'].search
+        self._busca_capitulo = self.tipo_citacao.por_categoria['capitulo'].search
+        # Identifica o conjunto de regras: linhas classificadas com outras regras não são reaproveitadas
+        self.versao = hashlib.sha1(json.dumps(regras, sort_keys=True, ensure_ascii=False).encode()).hexdigest()
+
+    @staticmethod
+    def validar(regras):
+        """Levanta ValueError se as regras não tiverem o formato esperado"""
+        desconhecidas = set(regras) - set(CATEGORIAS_OBRIGATORIAS) - {'limite_paginas_artigo'}
+        if desconhecidas:
+            raise ValueError(f"Regras de classificação desconhecidas: {', '.join(sorted(desconhecidas))}")
+        
+        for conjunto, obrigatorias in CATEGORIAS_OBRIGATORIAS.items():
+            categorias = regras.get(conjunto)
+            if not isinstance(categorias, dict):
+                raise ValueError(f"Regras '{conjunto}' devem mapear categoria -> lista de palavras-chave")
+            faltando = obrigatorias - set(categorias)
+            if faltando:
+                raise ValueError(f"Regras '{conjunto}' sem as categorias: {', '.join(sorted(faltando))}")
+            for nome, palavras in categorias.items():
+                if not nome.isidentifier():
+                    raise ValueError(f"Nome de categoria inválido em '{conjunto}': {nome!r}")
+                if not isinstance(palavras, list) or not all(isinstance(p, str) and p.strip() for p in palavras):
+                    raise ValueError(f"Categoria '{conjunto}.{nome}' deve ser uma lista de palavras não vazias")
+        
+        limite = regras.get('limite_paginas_artigo')
+        if isinstance(limite, bool) or not isinstance(limite, (int, float)) or limite < 0:
+            raise ValueError("'limite_paginas_artigo' deve ser um número não negativo")
+
+    @classmethod
+    def carregar(cls, caminho=None):
+        """Regras padrão, sobrepostas pelas do arquivo JSON `caminho`, se houver"""
+        regras = {chave: dict(valor) if isinstance(valor, dict) else valor
+                  for chave, valor in REGRAS_CLASSIFICACAO_PADRAO.items()}
+        if caminho:
+            with open(caminho, "r", encoding="utf-8") as f:
+                dados = json.load(f)
+            if not isinstance(dados, dict):
+                raise ValueError(f"{caminho}: as regras de classificação devem ser um objeto JSON")
+            for chave, valor in dados.items():
+                if isinstance(valor, dict):
+                    regras.setdefault(chave, {}).update(valor)
+                else:
+                    regras[chave] = valor
+        return cls(regras)
+
+    def classificar_volume(self, titulo, descricao, categorias, paginas):
+        """Tipo de citação de um volume (título e descrição em minúsculas, lista de categorias)"""
+        # Título e descrição numa única busca: nenhuma palavra-chave atravessa a quebra de linha
+        if self._busca_academico(f"{titulo}\n{descricao}"):
+            return 'Trabalho acadêmico'
+        if paginas and paginas < self.limite_paginas_artigo and self._busca_revista(', '.join(categorias).lower()):
+            return 'Artigo'
+        if self._busca_capitulo(titulo):
+            return 'Capítulo de livro'
+        return 'Livro'
+
+    def classificar_volumes(self, titulos, descricoes, categorias, paginas):
+        """Versão em lote de classificar_volume para colunas inteiras (pandas Series)"""
+        marcas_titulo = self.tipo_citacao.marcar(titulos.str.lower(), ['academico', 'capitulo'])
+        marcas_descricao = self.tipo_citacao.marcar(descricoes.str.lower(), ['academico'])
+        marcas_categorias = self.tipo_citacao.marcar(categorias.str.lower(), ['revista'])
+        paginas = pd.to_numeric(paginas, errors='coerce').fillna(0)
+        
+        tipos = pd.Series('Livro', index=titulos.index)
+        tipos[marcas_titulo['capitulo']] = 'Capítulo de livro'
+        tipos[(paginas > 0) & (paginas < self.limite_paginas_artigo) & marcas_categorias['revista']] = 'Artigo'
+        tipos[marcas_titulo['academico'] | marcas_descricao['academico']] = 'Trabalho acadêmico'
+        return tipos
+
+    def classificar_trabalho(self, titulo):
+        encontradas = self.tipo_trabalho.encontrar(titulo)
+        if 'dissertacao' in encontradas:
+            return 'Dissertação de Mestrado'
+        if 'tese' in encontradas:
+            return 'Tese de Doutorado'
+        return 'Trabalho de Conclusão de Curso'
+
+    def eh_lei(self, titulo):
+        """Se um título (em minúsculas) indica uma lei; versão escalar de `marcar_leis`"""
+        return self.lei.contem(titulo, 'lei')
+
+    def marcar_leis(self, titulos):
+        """Máscara das linhas cujo título (em minúsculas) indica uma lei"""
+        return self.lei.marcar(titulos)['lei']
+
+motor_classificacao = MotorClassificacao.carregar(REGRAS_CLASSIFICACAO)
+
+def classificar_resultados(resultados, descricoes=None):
+    """Preenche o 'tipo_citacao' de um lote de resultados com uma passada vetorizada
+
+    Usa título, categorias e páginas de cada resultado e, se dadas, as
+    descrições (que não ficam no resultado), como classificar_volume faria.
+    """
+    if resultados:
+        titulos = pd.Series([r['titulo_google'] for r in resultados])
+        descricoes = pd.Series(descricoes if descricoes is not None else '', index=titulos.index)
+        categorias = pd.Series([r.get('categorias') or '' for r in resultados], index=titulos.index)
+        paginas = pd.Series([r.get('paginas') or 0 for r in resultados], index=titulos.index)
+        tipos = motor_classificacao.classificar_volumes(titulos, descricoes, categorias, paginas)
+        for resultado, tipo in zip(resultados, tipos):
+            resultado['tipo_citacao'] = tipo
+    return resultados
+
+class CatalogoLocal:
+    """Índice bibliográfico local (SQLite FTS5), primeira camada de resolução
+
+    Alimentado por dumps bibliográficos (CSV/JSONL com ISBN, título,
+    autores, editora e ano) e por todo resultado bem-sucedido das buscas
+    externas. A busca é por texto completo no título, e o candidato só é
+    aceito se a similaridade de título/autor atingir a confiança mínima.
+    """
+
+    def __init__(self, caminho, confianca_minima=CATALOGO_CONFIANCA_MINIMA):
+        self.confianca_minima = confianca_minima
+        self._lock = threading.Lock()
+        self.conn = _conectar_sqlite(caminho)
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS livros (
+                id INTEGER PRIMARY KEY,
+                chave TEXT UNIQUE NOT NULL,
+                titulo TEXT NOT NULL,
+                autores TEXT,
+                resultado TEXT NOT NULL
+            )
+        """)
+        self.conn.execute("""
+            CREATE VIRTUAL TABLE IF NOT EXISTS livros_fts USING fts5(
+                titulo, autores, content='livros', content_rowid='id',
+                tokenize='unicode61 remove_diacritics 2'
+            )
+        """)
+
+    def __len__(self):
+        with self._lock:
+            return self.conn.execute("SELECT COUNT(*) FROM livros").fetchone()[0]
+
+    def adicionar(self, resultados):
+        """Indexa resultados no formato de buscar_info_livro_async; retorna quantos eram novos"""
+        novos = 0
+        with self._lock:
+            self.conn.execute("BEGIN")
+            for resultado in resultados:
+                titulo = resultado.get('titulo_google') or ''
+                if not titulo:
+                    continue
+                titulo_completo = f"{titulo} {resultado.get('subtitulo') or ''}".strip()
+                chave = resultado.get('isbn') or chave_busca(titulo_completo, resultado.get('autores'))
+                cursor = self.conn.execute(
+                    "INSERT OR IGNORE INTO livros (chave, titulo, autores, resultado) VALUES (?, ?, ?, ?)",
+                    (chave, titulo_completo, resultado.get('autores') or '', json.dumps(resultado, ensure_ascii=False))
+                )
+                if cursor.rowcount:
+                    self.conn.execute(
+                        "INSERT INTO livros_fts (rowid, titulo, autores) VALUES (?, ?, ?)",
+                        (cursor.lastrowid, titulo_completo, resultado.get('autores') or '')
+                    )
+                    novos += 1
+            self.conn.execute("COMMIT")
+        return novos
+
+    @staticmethod
+    def resultado_de_registro(registro):
+        """Converte um registro de dump bibliográfico no dicionário `resultado`
+
+        O 'tipo_citacao' fica em branco: `importar` classifica o lote inteiro de uma vez.
+        """
+        def campo(*nomes):
+            for nome in nomes:
+                valor = registro.get(nome)
+                if valor not in (None, ''):
+                    return valor
+            return ''
+        
+        autores = campo('authors', 'autores', 'author', 'autor')
+        if isinstance(autores, list):
+            autores = ', '.join(autores)
+        categorias = campo('categories', 'categorias', 'subjects', 'subject')
+        if isinstance(categorias, list):
+            categorias = ', '.join(categorias)
+        titulo = str(campo('title', 'titulo', 'título'))
+        subtitulo = str(campo('subtitle', 'subtitulo', 'subtítulo'))
+        return {
+            'isbn': str(campo('isbn', 'isbn13', 'isbn_13', 'isbn10', 'isbn_10')) or None,
+            'tipo_citacao': None,
+            'titulo_google': titulo,
+            'subtitulo': subtitulo,
+            'autores': str(autores),
+            'editora': str(campo('publisher', 'editora')),
+            'ano_publicacao': str(campo('year', 'ano', 'published_date', 'publishedDate'))[:4],
+            'paginas': campo('pages', 'paginas', 'pageCount'),
+            'categorias': str(categorias),
+            'idioma': str(campo('language', 'idioma')),
+            'print_type': 'BOOK',
+            'is_ebook': False
+        }
+
+    def importar(self, caminho, tamanho_lote=5000):
+        """Importa um dump CSV ou JSONL (um objeto por linha); retorna quantos registros eram novos"""
+        with open(caminho, "r", encoding="utf-8", newline='') as f:
+            if caminho.endswith(('.jsonl', '.ndjson')):
+                registros = (json.loads(linha) for linha in f if linha.strip())
+            else:
+                registros = csv.DictReader(f)
+            
+            novos = 0
+            lote, descricoes = [], []
+            for registro in registros:
+                lote.append(self.resultado_de_registro(registro))
+                descricoes.append(str(registro.get('description') or registro.get('descricao') or ''))
+                if len(lote) >= tamanho_lote:
+                    novos += self.adicionar(classificar_resultados(lote, descricoes))
+                    lote, descricoes = [], []
+            return novos + self.adicionar(classificar_resultados(lote, descricoes))
+
+    def buscar(self, titulo, autor=None, candidatos=5):
+        """Melhor resultado do catálogo para a referência, ou None abaixo da confiança mínima"""
+        titulo_normalizado = normalizar_chave(titulo)
+        termos = titulo_normalizado.split()
+        if not termos:
+            return None
+        
+        consulta = 'titulo : (' + ' OR '.join(f'"{termo}"' for termo in termos) + ')'
+        with self._lock:
+            linhas = self.conn.execute(
+                "SELECT livros.titulo, livros.autores, livros.resultado FROM livros_fts "
+                "JOIN livros ON livros.id = livros_fts.rowid "
+                "WHERE livros_fts MATCH ? ORDER BY bm25(livros_fts) LIMIT ?",
+                (consulta, candidatos)
+            ).fetchall()
+        
+        primeiro_autor = normalizar_chave(extrair_primeiro_autor(autor))
+        melhor, melhor_confianca = None, 0.0
+        numeros = set(re.findall(r'\d+', titulo_normalizado))
+        for titulo_catalogo, autores, resultado in linhas:
+            titulo_catalogo = normalizar_chave(titulo_catalogo)
+            # Volumes/edições diferentes têm títulos quase iguais: os números precisam coincidir
+            if set(re.findall(r'\d+', titulo_catalogo)) != numeros:
+                continue
+            confianca = difflib.SequenceMatcher(None, titulo_normalizado, titulo_catalogo).ratio()
+            if primeiro_autor:
+                confianca = 0.8 * confianca + 0.2 * (primeiro_autor in normalizar_chave(autores))
+            if confianca > melhor_confianca:
+                melhor, melhor_confianca = resultado, confianca
+        
+        if melhor is None or melhor_confianca < self.confianca_minima:
+            return None
+        return json.loads(melhor)
+
+catalogo_local = CatalogoLocal(CATALOGO_DB) if CATALOGO_LOCAL else None
+
+def preparar_dados():
+    """Migração do antigo cache JSON e indexação inicial do catálogo, fora da importação do módulo
+
+    Chamada na partida da API, dos workers e do modo em lote; a concessão
+    'preparacao' em tarefas.db faz só um processo por vez executá-la, e as
+    duas etapas não fazem nada quando já foram feitas.
+    """
+    if not armazenamento_tarefas.obter_concessao('preparacao', ID_WORKER, 300):
+        return
+    cache_buscas.migrar_json(f"{CACHE_DIR}/cache_buscas.json")
+    if catalogo_local is not None and len(catalogo_local) == 0:
+        # Primeira execução: indexa os resultados que já estão no cache
+        catalogo_local.adicionar(cache_buscas.resultados_encontrados())
 
 def identificar_tipo_citacao(volume_info):
     """Identifica o tipo de citação baseado nas informações do volume"""
-    categorias = volume_info.get('categories', [])
-    titulo = volume_info.get('title', '').lower()
-    descricao = volume_info.get('description', '').lower()
-    
-    palavras_academicas = ['dissertação', 'tese', 'monografia', 'trabalho de conclusão', 
-                          'tcc', 'dissertation', 'thesis', 'doctoral', 'mestrado', 'doutorado']
-    
-    for palavra in palavras_academicas:
-        if palavra in titulo or palavra in descricao:
-            return 'Trabalho acadêmico'
-    
-    page_count = volume_info.get('pageCount', 0)
-    if page_count and page_count < 50:
-        for cat in categorias:
-            if 'journal' in cat.lower() or 'article' in cat.lower() or 'revista' in cat.lower():
-                return 'Artigo'
-    
-    if 'capítulo' in titulo or 'chapter' in titulo:
-        return 'Capítulo de livro'
-    
-    return 'Livro'
+    return motor_classificacao.classificar_volume(
+        volume_info.get('title', '').lower(),
+        volume_info.get('description', '').lower(),
+        volume_info.get('categories', []),
+        volume_info.get('pageCount', 0)
+    )
 
 def preencher_colunas_por_tipo(row, info_livro):
     """Preenche as colunas apropriadas baseado no tipo de citação"""
@@ -192,100 +1996,614 @@ def preencher_colunas_por_tipo(row, info_livro):
         if info_livro.get('paginas'):
             row['Número de folhas'] = info_livro['paginas']
         
-        titulo_lower = row.get('Título', '').lower()
-        if 'dissertação' in titulo_lower or 'mestrado' in titulo_lower:
-            row['Tipo de Trabalho'] = 'Dissertação de Mestrado'
-        elif 'tese' in titulo_lower or 'doutorado' in titulo_lower:
-            row['Tipo de Trabalho'] = 'Tese de Doutorado'
-        else:
-            row['Tipo de Trabalho'] = 'Trabalho de Conclusão de Curso'
+        row['Tipo de Trabalho'] = motor_classificacao.classificar_trabalho(row.get('Título', '').lower())
     
     if info_livro.get('is_ebook'):
         row['É ebook (escreva SIM ou deixe em branco)'] = 'SIM'
     
     return row
 
+REGEX_NUMERO_LEI = re.compile(r'(lei|decreto|portaria|resolução)\s*n[º°]?\s*([\d\.]+)', re.IGNORECASE)
+
 def processar_leis(df):
-    """Identifica e processa registros que são leis"""
-    palavras_lei = ['lei', 'decreto', 'portaria', 'resolução', 'medida provisória', 
-                    'constituição', 'código', 'estatuto', 'norma', 'regulamento']
+    """Identifica e processa registros que são leis (vetorizado sobre a coluna Título)"""
+    if 'Título' not in df.columns or df.empty:
+        return df
     
-    for idx, row in df.iterrows():
-        titulo = str(row.get('Título', '')).lower()
-        
-        if any(palavra in titulo for palavra in palavras_lei):
-            df.at[idx, 'Tipo Citação (obrigatório)'] = 'Lei'
-            
-            match = re.search(r'(lei|decreto|portaria|resolução)\s*n[º°]?\s*([\d\.]+)', titulo, re.IGNORECASE)
-            if match:
-                tipo_lei = match.group(1).title()
-                numero_lei = match.group(2)
-                df.at[idx, 'Nome da Lei'] = f"{tipo_lei} nº {numero_lei}"
-            
-            if pd.isna(row.get('Jurisdição')):
-                df.at[idx, 'Jurisdição'] = 'Brasil'
-            
-            if not pd.isna(row.get('Url')):
-                df.at[idx, 'Material Online (escreva SIM ou deixe em branco)'] = 'SIM'
+    titulos = df['Título'].astype(str).str.lower()
+    eh_lei = motor_classificacao.marcar_leis(titulos)
+    if not eh_lei.any():
+        return df
+    
+    # Atribuir com máscara a uma coluna inexistente preencheria as demais linhas com 'nan' (texto)
+    for col in ('Tipo Citação (obrigatório)', 'Jurisdição', 'Material Online (escreva SIM ou deixe em branco)'):
+        if col not in df.columns:
+            df[col] = None
+    
+    df.loc[eh_lei, 'Tipo Citação (obrigatório)'] = 'Lei'
+    
+    numeros = titulos[eh_lei].str.extract(REGEX_NUMERO_LEI).dropna()
+    if not numeros.empty:
+        df.loc[numeros.index, 'Nome da Lei'] = numeros[0].str.title() + ' nº ' + numeros[1]
+    
+    df.loc[eh_lei & df['Jurisdição'].isna(), 'Jurisdição'] = 'Brasil'
+    
+    if 'Url' in df.columns:
+        df.loc[eh_lei & df['Url'].notna(), 'Material Online (escreva SIM ou deixe em branco)'] = 'SIM'
     
     return df
 
-async def processar_bibliografia_async(df, task_id):
-    """Processa toda a planilha buscando ISBNs e identificando tipos"""
-    df_resultado = df.copy()
-    total = len(df)
+def alteracoes_lei(row):
+    """Colunas de lei de uma única linha, com as mesmas regras de `processar_leis`"""
+    titulo = str(row.get('Título')).lower()
+    if not motor_classificacao.eh_lei(titulo):
+        return {}
+    alteracoes = {'Tipo Citação (obrigatório)': 'Lei'}
+    numero = REGEX_NUMERO_LEI.search(titulo)
+    if numero:
+        alteracoes['Nome da Lei'] = f"{numero.group(1).title()} nº {numero.group(2)}"
+    if pd.isna(row.get('Jurisdição')):
+        alteracoes['Jurisdição'] = 'Brasil'
+    if not pd.isna(row.get('Url')):
+        alteracoes['Material Online (escreva SIM ou deixe em branco)'] = 'SIM'
+    return alteracoes
+
+def alteracoes_linha(row, info_livro):
+    """Retorna apenas as colunas que preencher_colunas_por_tipo alterou na linha"""
+    preenchida = preencher_colunas_por_tipo(dict(row), info_livro)
+    return {col: valor for col, valor in preenchida.items() if col not in row or row[col] is not valor}
+
+def aplicar_alteracoes(df, alteracoes):
+    """Aplica de uma só vez um dicionário {índice: {coluna: valor}} ao DataFrame"""
+    if not alteracoes:
+        return df
+    
+    # Coluna a coluna, só com as linhas que a alteraram: um quadro único deixaria lacunas
+    # (NaN) e converteria colunas inteiras para float64 (120 gravado como 120.0)
+    por_coluna = {}
+    for idx, colunas in alteracoes.items():
+        for col, valor in colunas.items():
+            por_coluna.setdefault(col, {})[idx] = valor
+    novas = [col for col in por_coluna if col not in df.columns]
+    if novas:
+        df = df.reindex(columns=list(df.columns) + novas)
+    
+    df = df.astype({col: object for col in por_coluna})
+    for col, valores in por_coluna.items():
+        df.loc[list(valores), col] = pd.Series(valores, dtype=object)
+    return df
+
+# Colunas que o processamento pode preencher, na ordem em que são acrescentadas à saída
+COLUNAS_ENRIQUECIMENTO = [
+    'Isbn', 'Tipo Citação (obrigatório)', 'Subtítulo', 'Ano (apenas números)', 'Editora',
+    'Título do Capítulo', 'Nome do artigo', 'Nome da Revista', 'Página inicial e final do artigo',
+    'Ano de entrega', 'Ano de apresentação', 'Número de folhas', 'Tipo de Trabalho',
+    'É ebook (escreva SIM ou deixe em branco)', 'Nome da Lei', 'Jurisdição',
+    'Material Online (escreva SIM ou deixe em branco)'
+]
+
+def _valor_celula(valor):
+    """Converte o valor lido pelo openpyxl como pd.read_excel(dtype=str) faria"""
+    if valor is None:
+        return None
+    if isinstance(valor, float) and valor.is_integer():
+        valor = int(valor)
+    return str(valor)
+
+def _nomes_colunas(cabecalho):
+    return [str(nome) if nome is not None else f"Unnamed: {i}" for i, nome in enumerate(cabecalho)]
+
+def contar_registros(caminho, sheet_name="Bibliografia"):
+    """Número aproximado de registros da planilha (dimensão declarada, sem ler as linhas)"""
+    if not caminho.endswith('.xlsx'):
+        return len(pd.read_excel(caminho, sheet_name=sheet_name, dtype=str))
+    wb = openpyxl.load_workbook(caminho, read_only=True)
+    try:
+        ws = wb[sheet_name]
+        if ws.max_row is None:
+            # Arquivo sem dimensão declarada: percorre as linhas em modo streaming
+            ws.calculate_dimension(force=True)
+        return max((ws.max_row or 1) - 1, 0)
+    finally:
+        wb.close()
+
+def ler_planilha_em_lotes(caminho, sheet_name="Bibliografia", tamanho_lote=TAMANHO_LOTE):
+    """Lê a planilha em DataFrames de até `tamanho_lote` linhas (dtype str)
+
+    Arquivos .xlsx são lidos em modo read-only, linha a linha, de forma que
+    a memória não cresce com o tamanho da planilha. Linhas vazias no fim da
+    planilha são descartadas, como faz pd.read_excel.
+    """
+    if not caminho.endswith('.xlsx'):
+        df = pd.read_excel(caminho, sheet_name=sheet_name, dtype=str)
+        for inicio in range(0, len(df), tamanho_lote):
+            yield df.iloc[inicio:inicio + tamanho_lote]
+        return
+    
+    wb = openpyxl.load_workbook(caminho, read_only=True)
+    try:
+        linhas = wb[sheet_name].iter_rows(values_only=True)
+        colunas = _nomes_colunas(next(linhas, ()))
+        lote = []
+        vazias = 0
+        inicio = 0
+        for valores in linhas:
+            valores = [_valor_celula(v) for v in valores[:len(colunas)]]
+            if not any(v is not None for v in valores):
+                vazias += 1
+                continue
+            lote.extend([[None] * len(colunas)] * vazias)
+            vazias = 0
+            lote.append(valores + [None] * (len(colunas) - len(valores)))
+            if len(lote) >= tamanho_lote:
+                yield pd.DataFrame(lote, columns=colunas, index=range(inicio, inicio + len(lote)))
+                inicio += len(lote)
+                lote = []
+        if lote:
+            yield pd.DataFrame(lote, columns=colunas, index=range(inicio, inicio + len(lote)))
+    finally:
+        wb.close()
+
+class EscritorPlanilha:
+    """Grava a planilha de saída em modo write-only, lote a lote"""
+
+    def __init__(self, caminho, colunas, sheet_name="Bibliografia"):
+        self.caminho = caminho
+        self.colunas = colunas
+        self.wb = openpyxl.Workbook(write_only=True)
+        self.ws = self.wb.create_sheet(sheet_name)
+        self.ws.append(colunas)
+
+    def escrever(self, df):
+        df = df.reindex(columns=self.colunas).astype(object)
+        for valores in df.itertuples(index=False, name=None):
+            self.ws.append([None if pd.isna(v) else v for v in valores])
+
+    def fechar(self):
+        self.wb.save(self.caminho)
+        self.wb.close()
+
+class EscritorCSV:
+    """Grava a saída em CSV (UTF-8), lote a lote"""
+
+    def __init__(self, caminho, colunas):
+        self.colunas = colunas
+        self.arquivo = open(caminho, 'w', newline='', encoding='utf-8')
+        self.escritor = csv.writer(self.arquivo)
+        self.escritor.writerow(colunas)
+
+    def escrever(self, df):
+        df = df.reindex(columns=self.colunas).astype(object)
+        self.escritor.writerows(
+            ['' if pd.isna(v) else v for v in valores] for valores in df.itertuples(index=False, name=None)
+        )
+
+    def fechar(self):
+        self.arquivo.close()
+
+class EscritorNDJSON:
+    """Grava a saída em NDJSON, um objeto por linha
+
+    Com `esparso=True` as células vazias são omitidas (usado no modo delta).
+    """
+
+    def __init__(self, caminho, colunas, esparso=False):
+        self.colunas = colunas
+        self.esparso = esparso
+        self.arquivo = open(caminho, 'w', encoding='utf-8')
+
+    def escrever(self, df):
+        df = df.reindex(columns=self.colunas).astype(object)
+        if df.empty:
+            return
+        if not self.esparso:
+            self.arquivo.write(df.to_json(orient='records', lines=True, force_ascii=False).rstrip("\n") + "\n")
+            return
+        for valores in df.itertuples(index=False, name=None):
+            self.arquivo.write(_linha_ndjson({col: v for col, v in zip(self.colunas, valores) if not pd.isna(v)}))
+
+    def fechar(self):
+        self.arquivo.close()
+
+class EscritorParquet:
+    """Grava a saída em Parquet (todas as colunas como texto), um row group por lote"""
+
+    def __init__(self, caminho, colunas):
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+        self.pa = pa
+        self.colunas = colunas
+        self.schema = pa.schema([(col, pa.string()) for col in colunas])
+        self.escritor = pq.ParquetWriter(caminho, self.schema)
+
+    def escrever(self, df):
+        df = df.reindex(columns=self.colunas).astype(object)
+        dados = {col: [None if pd.isna(v) else str(v) for v in df[col]] for col in self.colunas}
+        self.escritor.write_table(self.pa.Table.from_pydict(dados, schema=self.schema))
+
+    def fechar(self):
+        self.escritor.close()
+
+# Formatos de saída: extensão -> media type do download
+FORMATOS_SAIDA = {
+    'xlsx': "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+    'csv': "text/csv",
+    'parquet': "application/vnd.apache.parquet",
+    'ndjson': "application/x-ndjson",
+}
+
+def validar_formato(formato):
+    """Levanta HTTPException se o formato não existe ou depende de um pacote ausente"""
+    if formato not in FORMATOS_SAIDA:
+        raise HTTPException(
+            status_code=400, detail=f"Formato inválido: use {', '.join(FORMATOS_SAIDA)}"
+        )
+    if formato == 'parquet' and importlib.util.find_spec('pyarrow') is None:
+        raise HTTPException(status_code=400, detail="Saída em Parquet requer o pacote pyarrow")
+
+def criar_escritor(formato, caminho, colunas, esparso=False):
+    if formato == 'csv':
+        return EscritorCSV(caminho, colunas)
+    if formato == 'ndjson':
+        return EscritorNDJSON(caminho, colunas, esparso=esparso)
+    if formato == 'parquet':
+        return EscritorParquet(caminho, colunas)
+    return EscritorPlanilha(caminho, colunas)
+
+def ler_saida_em_lotes(caminho, tamanho_lote=TAMANHO_LOTE):
+    """Lê um arquivo de saída (em qualquer formato) em DataFrames de até `tamanho_lote` linhas"""
+    formato = os.path.splitext(caminho)[1].lstrip('.')
+    if formato == 'csv':
+        yield from pd.read_csv(caminho, dtype=str, chunksize=tamanho_lote)
+    elif formato == 'parquet':
+        import pyarrow.parquet as pq
+        for lote in pq.ParquetFile(caminho).iter_batches(batch_size=tamanho_lote):
+            yield lote.to_pandas()
+    elif formato == 'ndjson':
+        # Linhas esparsas (modo delta) podem ter colunas diferentes: a primeira
+        # passada descobre todas as colunas, na ordem em que aparecem
+        colunas = {}
+        with open(caminho, encoding='utf-8') as arquivo:
+            for texto in arquivo:
+                colunas.update(dict.fromkeys(json.loads(texto)))
+        with open(caminho, encoding='utf-8') as arquivo:
+            lote = []
+            for texto in arquivo:
+                lote.append(json.loads(texto))
+                if len(lote) >= tamanho_lote:
+                    yield pd.DataFrame(lote, columns=list(colunas))
+                    lote = []
+            if lote or not colunas:
+                yield pd.DataFrame(lote, columns=list(colunas))
+    else:
+        yield from ler_planilha_em_lotes(caminho, tamanho_lote=tamanho_lote)
+
+def converter_saida(caminho, formato):
+    """Converte um arquivo de saída para `formato`, reaproveitando conversões anteriores"""
+    esparso = os.path.basename(caminho).startswith(PREFIXO_DELTA)
+    destino = f"{os.path.splitext(caminho)[0]}.{formato}"
+    if os.path.exists(destino):
+        return destino
+    
+    temporario = f"{destino}.{uuid.uuid4().hex}.tmp"
+    escritor = None
+    try:
+        for lote in ler_saida_em_lotes(caminho):
+            if escritor is None:
+                escritor = criar_escritor(formato, temporario, list(lote.columns), esparso=esparso)
+            escritor.escrever(lote)
+        if escritor is None:
+            escritor = criar_escritor(formato, temporario, [])
+        escritor.fechar()
+        os.replace(temporario, destino)
+    finally:
+        if os.path.exists(temporario):
+            os.remove(temporario)
+    return destino
+
+PREFIXO_SAIDA = "bibliografia_processada_"
+PREFIXO_DELTA = "bibliografia_delta_"
+
+# Colunas que o processamento pode alterar (o título muda nos capítulos de livro)
+COLUNAS_ALTERAVEIS = ['Título'] + COLUNAS_ENRIQUECIMENTO
+
+# Colunas de entrada que influenciam o enriquecimento de uma linha
+COLUNAS_IMPRESSAO = ['Título', 'Autor', 'Url'] + COLUNAS_ENRIQUECIMENTO
+
+def impressao_linha(row):
+    """Impressão digital das colunas relevantes da linha (e da versão das regras)
+
+    Colunas ausentes e vazias são distinguidas, porque algumas regras olham
+    apenas se a coluna existe na planilha.
+    """
+    partes = [motor_classificacao.versao] + [
+        '\x00' if col not in row else '' if pd.isna(row[col]) else str(row[col])
+        for col in COLUNAS_IMPRESSAO
+    ]
+    return hashlib.sha1('\x1f'.join(partes).encode()).hexdigest()
+
+def escrever_saida(escritor, lote, df_resultado, delta=False):
+    escritor.escrever(delta_lote(lote, df_resultado) if delta else df_resultado)
+
+def colunas_saida(colunas_entrada, delta=False):
+    """Colunas do arquivo de saída: as da planilha mais as de enriquecimento, ou as do modo delta"""
+    if delta:
+        return ['Linha'] + COLUNAS_ALTERAVEIS
+    colunas_entrada = list(colunas_entrada)
+    return colunas_entrada + [c for c in COLUNAS_ENRIQUECIMENTO if c not in colunas_entrada]
+
+def delta_lote(original, resultado):
+    """Somente as linhas e células que o enriquecimento alterou
+
+    As células não alteradas ficam vazias e a coluna 'Linha' traz o número
+    da linha na planilha de entrada (o cabeçalho é a linha 1).
+    """
+    colunas = [col for col in COLUNAS_ALTERAVEIS if col in resultado.columns]
+    novo = resultado.reindex(columns=colunas)
+    antigo = original.reindex(index=resultado.index, columns=colunas)
+    texto_novo, texto_antigo = novo.astype(str), antigo.astype(str)
+    vazio_novo = novo.isna() | (texto_novo == '')
+    vazio_antigo = antigo.isna() | (texto_antigo == '')
+    alteradas = (vazio_novo != vazio_antigo) | (~vazio_novo & (texto_novo != texto_antigo))
     
-    stats = {
+    linhas = alteradas.any(axis=1)
+    delta = novo[linhas].astype(object).where(alteradas[linhas], None)
+    delta.insert(0, 'Linha', delta.index + 2)
+    return delta
+
+def estatisticas_iniciais():
+    return {
         'encontrados': 0,
         'nao_encontrados': 0,
+        'reaproveitados': 0,
         'tipos': {'Livro': 0, 'Capítulo de livro': 0, 'Artigo': 0, 'Trabalho acadêmico': 0, 'Lei': 0}
     }
+
+def contabilizar_resultado(stats, tipo, provedor):
+    stats['encontrados'] += 1
+    stats['tipos'][tipo] = stats['tipos'].get(tipo, 0) + 1
+    stats.setdefault('provedores', {})
+    stats['provedores'][provedor] = stats['provedores'].get(provedor, 0) + 1
+
+async def enriquecer_lote(df, stats, chaves_vistas, ao_processar=None, buscar=None):
+    """Busca e preenche um lote de registros, retornando o DataFrame enriquecido
+
+    `ao_processar(n)` é chamado a cada `n` registros processados e
+    `buscar(titulo, autor)` substitui buscar_info_livro_async (modo em lote). Linhas
+    idênticas a outras já enriquecidas (mesma impressão digital) reaproveitam
+    o resultado anterior; as linhas sem resultado são sempre buscadas de novo,
+    passando pelo cache de "não encontrado".
+    """
+    grupos, reaproveitadas, impressoes = await em_executor(agrupar_lote, df, chaves_vistas)
+    
+    alteracoes = {}
+    for idx, anterior in reaproveitadas.items():
+        alteracoes[idx] = anterior['alteracoes']
+        contabilizar_resultado(stats, anterior['tipo'], anterior['provedor'])
+    stats['reaproveitados'] = stats.get('reaproveitados', 0) + len(reaproveitadas)
+    if reaproveitadas and ao_processar:
+        ao_processar(len(reaproveitadas))
+    
+    async def buscar_grupo(item):
+        chave, linhas = item
+        _, primeira = linhas[0]
+        info_livro = await (buscar or buscar_info_livro_async)(primeira.get('Título'), primeira.get('Autor'))
+        return linhas, info_livro
+    
+    novas = {}
+    with medir_etapa('buscas'):
+        async for linhas, info_livro in executar_concorrente(grupos.items(), buscar_grupo, MAX_CONCORRENCIA):
+            for idx, row in linhas:
+                if info_livro:
+                    alteracoes[idx] = alteracoes_linha(row, info_livro)
+                    
+                    tipo = info_livro.get('tipo_citacao', 'Livro')
+                    provedor = info_livro.get('provedor', 'desconhecido')
+                    contabilizar_resultado(stats, tipo, provedor)
+                    if cache_linhas is not None:
+                        novas[impressoes[idx]] = {'alteracoes': alteracoes[idx], 'tipo': tipo, 'provedor': provedor}
+                else:
+                    stats['nao_encontrados'] += 1
+            
+            if ao_processar:
+                ao_processar(len(linhas))
+    
+    if novas:
+        await em_executor(cache_linhas.salvar_varios, novas)
+    
+    return await em_executor(finalizar_lote, df, alteracoes)
+
+def agrupar_lote(df, chaves_vistas):
+    """Agrupa referências idênticas (cada chave é buscada uma única vez) e separa as linhas reaproveitáveis
+
+    Retorna (grupos, reaproveitadas, impressoes).
+    """
+    grupos = {}
+    reaproveitadas = {}
+    impressoes = {}
+    with medir_etapa('agrupamento'):
+        registros = [(idx, row) for idx, row in zip(df.index, df.to_dict('records')) if not pd.isna(row.get('Título'))]
+        if cache_linhas is not None:
+            impressoes = {idx: impressao_linha(row) for idx, row in registros}
+            anteriores = cache_linhas.obter_varios(set(impressoes.values()))
+        for idx, row in registros:
+            chave = chave_busca(row.get('Título'), row.get('Autor'))
+            chaves_vistas.add(chave)
+            if cache_linhas is not None and impressoes[idx] in anteriores:
+                reaproveitadas[idx] = anteriores[impressoes[idx]]
+            else:
+                grupos.setdefault(chave, []).append((idx, row))
+    return grupos, reaproveitadas, impressoes
+
+def finalizar_lote(df, alteracoes):
+    """Aplica as alterações das buscas e processa as leis do lote"""
+    # Junta os resultados das buscas em uma única atualização
+    with medir_etapa('aplicar_alteracoes'):
+        df = aplicar_alteracoes(df, alteracoes)
+    
+    # Processa leis
+    with medir_etapa('processar_leis'):
+        return processar_leis(df)
+
+_perfilador_ativo = None
+
+def iniciar_perfilador():
+    """Liga o cProfile para uma tarefa
+
+    O cProfile mede a thread do event loop inteira: o que outras tarefas
+    fizerem no loop ao mesmo tempo também aparece no perfil, mas o trabalho
+    bloqueante delas segue no executor (fora do perfil). Só uma tarefa por
+    vez é perfilada; se já houver outra, retorna None e a tarefa segue sem
+    perfil.
+    """
+    global _perfilador_ativo
+    if _perfilador_ativo is not None:
+        print("Perfil não capturado: outra tarefa já está sendo perfilada neste processo")
+        return None
+    _perfilador_ativo = cProfile.Profile()
+    _perfilador_ativo.enable()
+    return _perfilador_ativo
+
+def parar_perfilador(perfilador, caminho):
+    """Desliga o cProfile e grava as estatísticas (formato pstats) em `caminho`"""
+    global _perfilador_ativo
+    perfilador.disable()
+    _perfilador_ativo = None
+    perfilador.dump_stats(caminho)
+
+async def processar_bibliografia_async(file_path, task_id):
+    """Processa toda a planilha buscando ISBNs e identificando tipos
+
+    Se a tarefa já tiver lotes gravados (reinício do servidor), esses lotes
+    são reaproveitados e o processamento continua a partir do seguinte.
+    O status traz em 'tempos' o tempo gasto em cada etapa e em cada tipo de
+    resultado de busca. Com a opção `perfilar`, o processamento é
+    registrado pelo cProfile em perfil_{task_id}.pstats, ao lado da saída.
+    A saída é gravada no `formato` escolhido no upload; com `delta`, só as
+    linhas e colunas alteradas pelo enriquecimento.
+    """
+    total = await em_executor(contar_registros, file_path)
+    
+    tarefa = armazenamento_tarefas.obter(task_id)
+    if tarefa is None:
+        armazenamento_tarefas.criar(task_id, file_path, {'status': 'processing'})
+        tarefa = armazenamento_tarefas.obter(task_id)
+    
+    lotes_concluidos = tarefa['lotes_concluidos']
+    processados = tarefa['processados'] if lotes_concluidos else 0
+    stats = tarefa['stats'] if lotes_concluidos else estatisticas_iniciais()
     
     processing_status[task_id] = {
         'status': 'processing',
-        'progress': 0,
+        'progress': min(int(processados / total * 100), 99) if total else 0,
         'total': total,
-        'message': 'Processando bibliografia...'
+        'message': (f"Retomando do registro {processados + 1}..." if lotes_concluidos
+                    else 'Processando bibliografia...')
     }
+    armazenamento_tarefas.salvar_estado(task_id, processing_status[task_id])
+    notificar_progresso(task_id)
     
-    for idx, row in df.iterrows():
-        titulo = row.get('Título')
-        autor = row.get('Autor')
-        
-        if pd.isna(titulo):
-            continue
-        
-        info_livro = buscar_info_livro(titulo, autor, debug=False)
-        
-        if info_livro:
-            for col, valor in preencher_colunas_por_tipo(row, info_livro).items():
-                df_resultado.at[idx, col] = valor
-            
-            stats['encontrados'] += 1
-            tipo = info_livro.get('tipo_citacao', 'Livro')
-            stats['tipos'][tipo] = stats['tipos'].get(tipo, 0) + 1
-        else:
-            stats['nao_encontrados'] += 1
-        
-        # Atualiza progresso
-        progress = int((idx + 1) / total * 100)
+    ultimo_salvo = time.monotonic()
+    inicio_tarefa = time.monotonic()
+    processados_inicio = processados
+    
+    def atualizar_progresso(n):
+        nonlocal processados, ultimo_salvo
+        processados += n
+        metrica_registros.incrementar(n)
+        metrica_registros_por_segundo.definir(
+            (processados - processados_inicio) / max(time.monotonic() - inicio_tarefa, 1e-9), task_id=task_id
+        )
+        progress = min(int(processados / total * 100), 99) if total else 0
         processing_status[task_id]['progress'] = progress
-        processing_status[task_id]['message'] = f"Processado {idx + 1} de {total} registros"
+        processing_status[task_id]['message'] = f"Processado {processados} de {total} registros"
+        processing_status[task_id]['reaproveitados'] = stats.get('reaproveitados', 0)
+        notificar_progresso(task_id)
         
-        # Aguarda para não sobrecarregar a API
-        await asyncio.sleep(1.2)
-    
-    # Processa leis
-    df_resultado = processar_leis(df_resultado)
+        # Outros processos leem o progresso do armazenamento compartilhado
+        if time.monotonic() - ultimo_salvo >= INTERVALO_FILA:
+            armazenamento_tarefas.salvar_estado(task_id, processing_status[task_id])
+            ultimo_salvo = time.monotonic()
     
-    # Salva resultado
-    output_filename = f"bibliografia_processada_{task_id}.xlsx"
+    formato = tarefa['opcoes'].get('formato', 'xlsx')
+    delta = tarefa['opcoes'].get('delta', False)
+    output_filename = f"{PREFIXO_DELTA if delta else PREFIXO_SAIDA}{task_id}.{formato}"
     output_path = os.path.join(PROCESSED_DIR, output_filename)
-    df_resultado.to_excel(output_path, index=False)
+    escritor = None
+    chaves_vistas = set()
     
-    # Salva cache
-    with open(f"{CACHE_DIR}/cache_buscas.json", "w", encoding="utf-8") as f:
-        json.dump(cache_buscas, f, ensure_ascii=False, indent=2)
+    perfil = PerfilTarefa()
+    token_perfil = perfil_tarefa.set(perfil)
+    token_tarefa = tarefa_atual.set(task_id)
+    escalonador_buscas.definir_peso(task_id, tarefa['opcoes'].get('peso', 1.0))
+    perfilador = iniciar_perfilador() if tarefa['opcoes'].get('perfilar') else None
+    token_perfilando = perfilando.set(perfilador is not None)
+    profile_filename = f"perfil_{task_id}.pstats"
+    
+    metrica_registros_por_segundo.definir(0, task_id=task_id)
+    try:
+        # Leitura, escrita e checkpoints rodam no executor: o event loop segue livre para as outras requisições
+        lotes = iterar_medindo(ler_planilha_em_lotes(file_path, tamanho_lote=tarefa['tamanho_lote']), 'leitura')
+        numero = -1
+        while (lote := await em_executor(next, lotes, None)) is not None:
+            numero += 1
+            if escritor is None:
+                escritor = await em_executor(
+                    criar_escritor, formato, output_path, colunas_saida(lote.columns, delta), esparso=delta
+                )
+            
+            if numero < lotes_concluidos:
+                # Lote já enriquecido antes do reinício
+                df_resultado = await em_executor(armazenamento_tarefas.carregar_lote, task_id, numero)
+                chaves_vistas.update(
+                    chave_busca(titulo, autor)
+                    for titulo, autor in zip(lote.get('Título', [None] * len(lote)),
+                                             lote.get('Autor', [None] * len(lote)))
+                    if not pd.isna(titulo)
+                )
+            else:
+                df_resultado = await enriquecer_lote(lote, stats, chaves_vistas, atualizar_progresso)
+                processing_status[task_id]['tempos'] = perfil.resumo()
+                with medir_etapa('checkpoint'):
+                    await em_executor(
+                        armazenamento_tarefas.salvar_lote,
+                        task_id, numero, df_resultado, dict(processing_status[task_id]), processados, stats
+                    )
+            with medir_etapa('escrita'):
+                await em_executor(escrever_saida, escritor, lote, df_resultado, delta)
+        
+        if escritor is None:
+            escritor = await em_executor(criar_escritor, formato, output_path, colunas_saida([], delta))
+        with medir_etapa('escrita'):
+            await em_executor(escritor.fechar)
+    except Exception as e:
+        print(f"Erro no processamento: {e}")
+        processing_status[task_id] = {
+            'status': 'error',
+            'progress': processing_status[task_id].get('progress', 0),
+            'total': total,
+            'message': f"Erro no processamento: {e}",
+            'tempos': perfil.resumo()
+        }
+        if perfilador is not None:
+            processing_status[task_id]['profile_file'] = profile_filename
+        armazenamento_tarefas.salvar_estado(task_id, processing_status[task_id])
+        notificar_progresso(task_id)
+        raise
+    finally:
+        metrica_registros_por_segundo.remover(task_id=task_id)
+        perfil_tarefa.reset(token_perfil)
+        tarefa_atual.reset(token_tarefa)
+        perfilando.reset(token_perfilando)
+        escalonador_buscas.remover(task_id)
+        if perfilador is not None:
+            parar_perfilador(perfilador, os.path.join(PROCESSED_DIR, profile_filename))
+    
+    stats['referencias_unicas'] = len(chaves_vistas)
+    if processados > processados_inicio:
+        metrica_vazao_tarefas.observar(
+            (processados - processados_inicio) / max(time.monotonic() - inicio_tarefa, 1e-9)
+        )
     
     # Atualiza status final
     processing_status[task_id] = {
@@ -294,11 +2612,292 @@ async def processar_bibliografia_async(df, task_id):
         'total': total,
         'message': 'Processamento concluído!',
         'stats': stats,
+        'tempos': perfil.resumo(),
         'output_file': output_filename
     }
+    if perfilador is not None:
+        processing_status[task_id]['profile_file'] = profile_filename
+    armazenamento_tarefas.finalizar(task_id, processing_status[task_id])
+    notificar_progresso(task_id)
     
     return output_path
 
+sinal_fila = asyncio.Event()
+
+async def executar_tarefa(task_id, arquivo):
+    """Executa uma tarefa retirada da fila, registrando erro se o arquivo sumiu"""
+    if not os.path.exists(arquivo):
+        armazenamento_tarefas.salvar_estado(task_id, {
+            'status': 'error', 'progress': 0, 'total': 0,
+            'message': 'Arquivo de entrada não encontrado para o processamento'
+        })
+        return
+    try:
+        await processar_bibliografia_async(arquivo, task_id)
+    except Exception as e:
+        print(f"Tarefa {task_id} falhou: {e}")
+
+async def consumir_fila(limite=TAREFAS_SIMULTANEAS):
+    """Consome a fila compartilhada, com até `limite` tarefas simultâneas neste processo
+
+    Vários processos (workers da API ou `python main.py worker`) podem
+    consumir a mesma fila: a reserva de cada tarefa é atômica no SQLite e
+    tarefas de workers que pararam são retomadas do último checkpoint.
+    """
+    ativas = {}
+    try:
+        while True:
+            while len(ativas) < limite:
+                reivindicada = armazenamento_tarefas.reivindicar(ID_WORKER)
+                if reivindicada is None:
+                    break
+                task_id, arquivo = reivindicada
+                ativas[asyncio.create_task(executar_tarefa(task_id, arquivo))] = task_id
+            
+            armazenamento_tarefas.renovar(list(ativas.values()))
+            sinal_fila.clear()
+            espera = [asyncio.create_task(sinal_fila.wait())]
+            prontas, _ = await asyncio.wait(
+                list(ativas) + espera, timeout=INTERVALO_FILA, return_when=asyncio.FIRST_COMPLETED
+            )
+            espera[0].cancel()
+            for tarefa in prontas:
+                ativas.pop(tarefa, None)
+    finally:
+        for tarefa in ativas:
+            tarefa.cancel()
+        armazenamento_tarefas.liberar(ID_WORKER)
+
+async def iniciar_consumidor():
+    """Inicia o consumidor da fila dentro do processo da API, se habilitado"""
+    if CONSUMIDOR_EMBUTIDO:
+        app.state.consumidor = asyncio.create_task(consumir_fila())
+
+async def parar_consumidor():
+    consumidor = getattr(app.state, 'consumidor', None)
+    if consumidor is not None:
+        consumidor.cancel()
+        try:
+            await consumidor
+        except asyncio.CancelledError:
+            pass
+
+def executar_worker():
+    """Processo worker: consome a fila, dividindo o limite de requisições com os demais processos"""
+    global ID_WORKER
+    ID_WORKER = f"{socket.gethostname()}:{os.getpid()}"
+    preparar_dados()
+    try:
+        asyncio.run(consumir_fila())
+    except KeyboardInterrupt:
+        pass
+
+def iniciar_workers(processos):
+    """Inicia `processos` workers, que dividem o limite RATE_LIMIT_RPS com a API pelo balde compartilhado"""
+    contexto = multiprocessing.get_context("spawn")
+    workers = [contexto.Process(target=executar_worker, daemon=False) for _ in range(processos)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+
+# Modo em lote (linha de comando): vários processos leem, classificam e gravam as
+# planilhas, e todas as buscas externas passam pelo processo principal, que tem o
+# único limitador de taxa, o escalonador e o cache.
+
+def expandir_entradas(entradas):
+    """Arquivos Excel indicados por caminhos, diretórios ou padrões glob, sem repetição"""
+    arquivos = []
+    for entrada in entradas:
+        if os.path.isdir(entrada):
+            candidatos = sorted(glob.glob(os.path.join(entrada, '*.xls*')))
+        else:
+            candidatos = sorted(glob.glob(entrada)) or [entrada]
+        arquivos.extend(c for c in candidatos if c.endswith(('.xlsx', '.xls')) and not os.path.basename(c).startswith('~$'))
+    return list(dict.fromkeys(arquivos))
+
+class ClienteBuscasRemoto:
+    """Lado do worker do modo em lote: envia cada busca ao processo principal e aguarda a resposta"""
+
+    def __init__(self, id_worker, pedidos, respostas):
+        self.id_worker = id_worker
+        self.pedidos = pedidos
+        self.respostas = respostas
+        self.tarefa = None
+        self.pendentes = {}
+        self._contador = itertools.count()
+        self._loop = None
+
+    def iniciar(self):
+        self._loop = asyncio.get_running_loop()
+        threading.Thread(target=self._receber, daemon=True).start()
+
+    def _receber(self):
+        while True:
+            id_pedido, resultado = self.respostas.get()
+            self._loop.call_soon_threadsafe(self._entregar, id_pedido, resultado)
+
+    def _entregar(self, id_pedido, resultado):
+        futuro = self.pendentes.pop(id_pedido, None)
+        if futuro is not None and not futuro.done():
+            futuro.set_result(resultado)
+
+    async def buscar(self, titulo, autor=None):
+        if pd.isna(titulo):
+            return None
+        id_pedido = next(self._contador)
+        futuro = self._loop.create_future()
+        self.pendentes[id_pedido] = futuro
+        self.pedidos.put((self.id_worker, id_pedido, self.tarefa, titulo, None if pd.isna(autor) else autor))
+        return await futuro
+
+async def servir_buscas_lote(pedidos, respostas):
+    """Lado do processo principal: resolve as buscas pedidas pelos workers até receber None
+
+    Cada arquivo é uma tarefa no escalonador, então as planilhas dividem a
+    taxa de forma justa, e buscas iguais de arquivos diferentes são
+    resolvidas uma única vez (cache e single-flight).
+    """
+    loop = asyncio.get_running_loop()
+    fila = asyncio.Queue()
+    
+    def ler_pedidos():
+        while True:
+            pedido = pedidos.get()
+            loop.call_soon_threadsafe(fila.put_nowait, pedido)
+            if pedido is None:
+                return
+    
+    threading.Thread(target=ler_pedidos, daemon=True).start()
+    
+    async def resolver(id_worker, id_pedido, tarefa, titulo, autor):
+        tarefa_atual.set(tarefa)
+        try:
+            resultado = await buscar_info_livro_async(titulo, autor)
+        except Exception as e:
+            print(f"Erro na busca: {e}")
+            resultado = None
+        respostas[id_worker].put((id_pedido, resultado))
+    
+    em_andamento = set()
+    while (pedido := await fila.get()) is not None:
+        tarefa = asyncio.ensure_future(resolver(*pedido))
+        em_andamento.add(tarefa)
+        tarefa.add_done_callback(em_andamento.discard)
+
+async def processar_arquivo_lote(caminho, destino, formato, delta, buscar):
+    """Enriquece uma planilha inteira fora da API, gravando a saída em `destino`"""
+    stats = estatisticas_iniciais()
+    chaves_vistas = set()
+    escritor = None
+    total = 0
+    try:
+        for lote in ler_planilha_em_lotes(caminho):
+            if escritor is None:
+                escritor = criar_escritor(formato, destino, colunas_saida(lote.columns, delta), esparso=delta)
+            df_resultado = await enriquecer_lote(lote, stats, chaves_vistas, buscar=buscar)
+            escritor.escrever(delta_lote(lote, df_resultado) if delta else df_resultado)
+            total += len(lote)
+        if escritor is None:
+            escritor = criar_escritor(formato, destino, colunas_saida([], delta))
+    finally:
+        if escritor is not None:
+            escritor.fechar()
+    stats['total'] = total
+    stats['referencias_unicas'] = len(chaves_vistas)
+    return stats
+
+def executar_worker_lote(id_worker, arquivos, pedidos, respostas, resultados, saida, formato, delta):
+    """Processo worker do modo em lote: processa arquivos da fila até receber None"""
+    cliente = ClienteBuscasRemoto(id_worker, pedidos, respostas)
+    
+    async def processar():
+        cliente.iniciar()
+        loop = asyncio.get_running_loop()
+        while (caminho := await loop.run_in_executor(None, arquivos.get)) is not None:
+            nome = os.path.splitext(os.path.basename(caminho))[0]
+            destino = os.path.join(saida, f"{nome}_{'delta' if delta else 'processada'}.{formato}")
+            cliente.tarefa = caminho
+            inicio = time.monotonic()
+            try:
+                stats = await processar_arquivo_lote(caminho, destino, formato, delta, cliente.buscar)
+                stats['segundos'] = round(time.monotonic() - inicio, 3)
+                resultados.put((caminho, destino, stats, None))
+            except Exception as e:
+                resultados.put((caminho, None, None, str(e)))
+    
+    try:
+        asyncio.run(processar())
+    except KeyboardInterrupt:
+        pass
+
+def executar_lote(entradas, saida=PROCESSED_DIR, processos=None, formato='xlsx', delta=False):
+    """Processa vários arquivos com `processos` workers e uma única etapa de buscas
+
+    Retorna a lista de (arquivo, saída, estatísticas, erro), na ordem em que terminaram.
+    """
+    arquivos = expandir_entradas(entradas)
+    if not arquivos:
+        return []
+    os.makedirs(saida, exist_ok=True)
+    preparar_dados()
+    processos = max(1, min(processos or os.cpu_count() or 1, len(arquivos)))
+    
+    contexto = multiprocessing.get_context("spawn")
+    fila_arquivos = contexto.Queue()
+    pedidos = contexto.Queue()
+    respostas = [contexto.Queue() for _ in range(processos)]
+    resultados = contexto.Queue()
+    for arquivo in arquivos:
+        fila_arquivos.put(arquivo)
+    for _ in range(processos):
+        fila_arquivos.put(None)
+    
+    workers = [
+        contexto.Process(
+            target=executar_worker_lote,
+            args=(i, fila_arquivos, pedidos, respostas[i], resultados, saida, formato, delta)
+        )
+        for i in range(processos)
+    ]
+    for worker in workers:
+        worker.start()
+    
+    def proximo_resultado():
+        while True:
+            try:
+                return resultados.get(timeout=1)
+            except queue.Empty:
+                if not any(worker.is_alive() for worker in workers):
+                    return None
+    
+    async def coordenar():
+        servidor = asyncio.ensure_future(servir_buscas_lote(pedidos, respostas))
+        loop = asyncio.get_running_loop()
+        concluidos = []
+        for _ in arquivos:
+            resultado = await loop.run_in_executor(None, proximo_resultado)
+            if resultado is None:
+                print("Os workers pararam antes de concluir todos os arquivos")
+                break
+            arquivo, destino, stats, erro = resultado
+            if erro:
+                print(f"{arquivo}: erro - {erro}")
+            else:
+                print(f"{arquivo}: {stats['total']} registros, {stats['encontrados']} encontrados, "
+                      f"{stats['segundos']}s -> {destino}")
+            concluidos.append((arquivo, destino, stats, erro))
+        pedidos.put(None)
+        await servidor
+        await fechar_cliente_http()
+        return concluidos
+    
+    try:
+        return asyncio.run(coordenar())
+    finally:
+        for worker in workers:
+            worker.join()
+
 @app.get("/", response_class=HTMLResponse)
 async def home():
     """Página inicial com interface de upload"""
@@ -454,7 +3053,7 @@ async def home():
                 .then(data => {
                     if (data.task_id) {
                         currentTaskId = data.task_id;
-                        checkStatus();
+                        followProgress();
                     } else {
                         throw new Error(data.detail || 'Erro ao processar arquivo');
                     }
@@ -466,27 +3065,54 @@ async def home():
                 });
             }
             
+            function followProgress() {
+                // Progresso por Server-Sent Events; polling de /status como alternativa
+                if (!window.EventSource) {
+                    checkStatus();
+                    return;
+                }
+                
+                const source = new EventSource(`/status/${currentTaskId}/eventos`);
+                const handle = (e) => handleStatus(JSON.parse(e.data));
+                
+                source.addEventListener('progresso', handle);
+                source.addEventListener('concluido', (e) => { source.close(); handle(e); });
+                source.addEventListener('erro', (e) => { source.close(); handle(e); });
+                source.onerror = () => {
+                    source.close();
+                    checkStatus();
+                };
+            }
+            
             function checkStatus() {
                 if (!currentTaskId) return;
                 
                 fetch(`/status/${currentTaskId}`)
                 .then(response => response.json())
                 .then(data => {
-                    updateProgress(data.progress);
-                    document.getElementById('statusMessage').textContent = data.message;
-                    
-                    if (data.status === 'completed') {
-                        showResults(data);
-                    } else if (data.status === 'processing') {
+                    if (handleStatus(data)) {
                         setTimeout(checkStatus, 2000);
-                    } else if (data.status === 'error') {
-                        document.getElementById('errorContainer').innerHTML = 
-                            '<p class="error">❌ Erro no processamento</p>';
-                        document.getElementById('progressContainer').style.display = 'none';
                     }
                 });
             }
             
+            function handleStatus(data) {
+                // Retorna true enquanto a tarefa ainda está em andamento
+                updateProgress(data.progress);
+                document.getElementById('statusMessage').textContent = data.message;
+                
+                if (data.status === 'completed') {
+                    showResults(data);
+                } else if (data.status === 'processing' || data.status === 'queued') {
+                    return true;
+                } else if (data.status === 'error') {
+                    document.getElementById('errorContainer').innerHTML = 
+                        '<p class="error">❌ Erro no processamento</p>';
+                    document.getElementById('progressContainer').style.display = 'none';
+                }
+                return false;
+            }
+            
             function updateProgress(progress) {
                 const fill = document.getElementById('progressFill');
                 fill.style.width = progress + '%';
@@ -501,6 +3127,8 @@ async def home():
                     <h3>📊 Estatísticas</h3>
                     <p>✅ Encontrados: ${stats.encontrados} (${(stats.encontrados/data.total*100).toFixed(1)}%)</p>
                     <p>❌ Não encontrados: ${stats.nao_encontrados}</p>
+                    <p>🔁 Referências únicas: ${stats.referencias_unicas}</p>
+                    <p>♻️ Linhas reaproveitadas de envios anteriores: ${stats.reaproveitados || 0}</p>
                     <h4>Distribuição por tipo:</h4>
                     <ul>
                         ${Object.entries(stats.tipos)
@@ -543,27 +3171,41 @@ async def home():
     """
 
 @app.post("/upload")
-async def upload_file(background_tasks: BackgroundTasks, file: UploadFile = File(...)):
-    """Endpoint para upload do arquivo Excel"""
+async def upload_file(file: UploadFile = File(...), formato: str = 'xlsx', delta: bool = False,
+                      perfilar: bool = False, peso: float = 1.0):
+    """Endpoint para upload do arquivo Excel
+
+    `formato` escolhe a saída (xlsx, csv, parquet ou ndjson) e `delta=true`
+    grava só as linhas e colunas alteradas, com o número da linha original.
+    Com `?perfilar=true` o processamento é registrado pelo cProfile e o
+    arquivo .pstats fica disponível em /download, indicado em 'profile_file'.
+    `peso` é a parcela relativa da tarefa no orçamento de buscas externas.
+    """
     # Validar arquivo
     if not file.filename.endswith(('.xlsx', '.xls')):
         raise HTTPException(status_code=400, detail="Arquivo deve ser Excel (.xlsx ou .xls)")
+    validar_formato(formato)
+    if not 0 < peso <= 100:
+        raise HTTPException(status_code=400, detail="Peso deve estar entre 0 e 100")
     
     # Gerar ID único para a tarefa
     task_id = str(uuid.uuid4())
     
-    # Salvar arquivo
+    # Salvar arquivo em blocos, sem carregar o upload inteiro na memória
     file_path = os.path.join(UPLOAD_DIR, f"{task_id}_{file.filename}")
-    with open(file_path, "wb") as f:
-        content = await file.read()
-        f.write(content)
+    async with aiofiles.open(file_path, "wb") as f:
+        while bloco := await file.read(TAMANHO_BLOCO_UPLOAD):
+            await f.write(bloco)
     
     try:
-        # Carregar DataFrame
-        df = pd.read_excel(file_path, sheet_name="Bibliografia", dtype=str)
+        # Valida a planilha "Bibliografia" sem carregar as linhas
+        await em_executor(contar_registros, file_path)
         
-        # Iniciar processamento em background
-        background_tasks.add_task(processar_bibliografia_async, df, task_id)
+        # Coloca a tarefa na fila compartilhada de processamento
+        armazenamento_tarefas.criar(task_id, file_path, {
+            'status': 'queued', 'progress': 0, 'total': 0, 'message': 'Na fila...'
+        }, opcoes={'formato': formato, 'delta': delta, 'perfilar': perfilar, 'peso': peso})
+        sinal_fila.set()
         
         return {"task_id": task_id, "message": "Processamento iniciado"}
     
@@ -572,33 +3214,246 @@ async def upload_file(background_tasks: BackgroundTasks, file: UploadFile = File
         os.remove(file_path)
         raise HTTPException(status_code=400, detail=f"Erro ao ler arquivo: {str(e)}")
 
+def obter_estado(task_id):
+    """Estado da tarefa: o dicionário local se ela roda neste processo, senão o armazenamento compartilhado"""
+    if task_id in processing_status:
+        return processing_status[task_id]
+    
+    # Tarefa de outro processo ou de antes de um reinício: consulta o armazenamento compartilhado
+    tarefa = armazenamento_tarefas.obter(task_id)
+    return tarefa['estado'] if tarefa else None
+
 @app.get("/status/{task_id}")
 async def get_status(task_id: str):
-    """Endpoint para verificar status do processamento"""
-    if task_id not in processing_status:
+    """Endpoint para verificar status do processamento
+
+    Tarefas na fila trazem 'posicao_fila'; tarefas em processamento neste
+    processo trazem quantas buscas aguardam vez no escalonador e a posição
+    da tarefa nele.
+    """
+    estado = obter_estado(task_id)
+    if estado is None:
         raise HTTPException(status_code=404, detail="Tarefa não encontrada")
     
-    return processing_status[task_id]
+    if estado.get('status') == 'queued':
+        return dict(estado, posicao_fila=armazenamento_tarefas.posicao_fila(task_id))
+    if estado.get('status') == 'processing' and task_id in processing_status:
+        return dict(estado, **escalonador_buscas.situacao(task_id))
+    return estado
+
+@app.get("/status/{task_id}/eventos")
+async def stream_status(task_id: str):
+    """Stream de progresso via Server-Sent Events
+
+    Emite um evento `progresso` a cada lote de registros processado e um
+    evento final `concluido` (com as estatísticas) ou `erro`. Tarefas de
+    outros processos são acompanhadas pelo armazenamento compartilhado.
+    """
+    if obter_estado(task_id) is None:
+        raise HTTPException(status_code=404, detail="Tarefa não encontrada")
+    
+    async def eventos():
+        ultimo = None
+        ultimo_envio = time.monotonic()
+        evento = None
+        try:
+            while True:
+                estado = obter_estado(task_id) or {}
+                dados = json.dumps(estado, ensure_ascii=False)
+                if dados != ultimo:
+                    ultimo = dados
+                    ultimo_envio = time.monotonic()
+                    if estado.get('status') == 'completed':
+                        yield f"event: concluido\ndata: {dados}\n\n"
+                        return
+                    if estado.get('status') == 'error':
+                        yield f"event: erro\ndata: {dados}\n\n"
+                        return
+                    yield f"event: progresso\ndata: {dados}\n\n"
+                elif time.monotonic() - ultimo_envio >= 15:
+                    # Comentário de keep-alive para proxies não fecharem a conexão
+                    ultimo_envio = time.monotonic()
+                    yield ": keep-alive\n\n"
+                
+                evento = eventos_progresso.setdefault(task_id, asyncio.Event())
+                try:
+                    await asyncio.wait_for(evento.wait(), timeout=INTERVALO_FILA)
+                except asyncio.TimeoutError:
+                    pass
+        finally:
+            # Tarefas de outros processos nunca passam por notificar_progresso, que removeria o evento
+            if evento is not None and eventos_progresso.get(task_id) is evento:
+                del eventos_progresso[task_id]
+    
+    return StreamingResponse(
+        eventos(), media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+class Referencia(BaseModel):
+    titulo: str
+    autor: Optional[str] = None
+
+class LoteReferencias(BaseModel):
+    referencias: List[Referencia]
+
+def enriquecer_referencia(titulo, autor, info_livro):
+    """Colunas preenchidas para uma referência avulsa, com as mesmas regras da planilha"""
+    row = {'Título': titulo, 'Autor': autor}
+    linha = {**row, **(alteracoes_linha(row, info_livro) if info_livro else {})}
+    linha.update(alteracoes_lei(linha))
+    return {
+        col: valor for col, valor in linha.items()
+        if not pd.isna(valor) and (col not in row or row[col] != valor)
+    }
+
+def _linha_ndjson(dados):
+    return json.dumps(dados, ensure_ascii=False, default=lambda v: v.item() if hasattr(v, 'item') else str(v)) + "\n"
+
+@app.post("/enriquecer")
+async def enriquecer_referencias(lote: LoteReferencias):
+    """Enriquece uma lista de referências {titulo, autor} sem planilha
+
+    Responde em NDJSON, uma linha por referência assim que ela é resolvida:
+    as que já estão no cache saem imediatamente e as demais conforme as
+    buscas terminam. Referências repetidas são buscadas uma única vez.
+    """
+    if len(lote.referencias) > MAX_REFERENCIAS_LOTE:
+        raise HTTPException(
+            status_code=400, detail=f"Máximo de {MAX_REFERENCIAS_LOTE} referências por requisição"
+        )
+    
+    grupos = {}
+    for indice, ref in enumerate(lote.referencias):
+        grupos.setdefault(chave_busca(ref.titulo, ref.autor), []).append((indice, ref))
+    
+    def linhas_grupo(referencias, info_livro):
+        for indice, ref in referencias:
+            yield _linha_ndjson({
+                'indice': indice,
+                'titulo': ref.titulo,
+                'autor': ref.autor,
+                'encontrado': bool(info_livro),
+                'colunas': enriquecer_referencia(ref.titulo, ref.autor, info_livro)
+            })
+    
+    id_lote = f"enriquecer:{uuid.uuid4()}"
+    
+    async def buscar_grupo(referencias):
+        _, ref = referencias[0]
+        tarefa_atual.set(id_lote)
+        return referencias, await buscar_info_livro_async(ref.titulo, ref.autor)
+    
+    async def gerar():
+        pendentes = []
+        for chave, referencias in grupos.items():
+            encontrado, info_livro = consultar_cache(referencias[0][1].titulo, referencias[0][1].autor)
+            if encontrado:
+                registrar_consulta_cache(encontrado, info_livro)
+                for linha in linhas_grupo(referencias, info_livro):
+                    yield linha
+                # Um lote todo em cache não pode prender o loop (nem o /health) até o fim
+                await asyncio.sleep(0)
+            else:
+                pendentes.append(referencias)
+        
+        try:
+            async for referencias, info_livro in executar_concorrente(pendentes, buscar_grupo, MAX_CONCORRENCIA):
+                for linha in linhas_grupo(referencias, info_livro):
+                    yield linha
+        finally:
+            escalonador_buscas.remover(id_lote)
+    
+    return StreamingResponse(gerar(), media_type="application/x-ndjson")
 
 @app.get("/download/{filename}")
-async def download_file(filename: str):
-    """Endpoint para download do arquivo processado"""
+async def download_file(filename: str, formato: Optional[str] = None):
+    """Endpoint para download do arquivo processado
+
+    `formato` converte a saída para outro formato (xlsx, csv, parquet ou
+    ndjson); a conversão fica gravada para os próximos downloads.
+    """
     file_path = os.path.join(PROCESSED_DIR, filename)
     
     if not os.path.exists(file_path):
         raise HTTPException(status_code=404, detail="Arquivo não encontrado")
     
+    if filename.endswith('.pstats'):
+        return FileResponse(path=file_path, filename=filename, media_type="application/octet-stream")
+    
+    atual = os.path.splitext(filename)[1].lstrip('.')
+    formato = formato or atual
+    validar_formato(formato)
+    if formato != atual:
+        try:
+            file_path = await em_executor(converter_saida, file_path, formato)
+        except Exception as e:
+            raise HTTPException(status_code=500, detail=f"Erro ao converter arquivo: {str(e)}")
+    
+    prefixo = PREFIXO_DELTA if filename.startswith(PREFIXO_DELTA) else PREFIXO_SAIDA
     return FileResponse(
         path=file_path,
-        filename=f"bibliografia_processada_{datetime.now().strftime('%Y%m%d_%H%M%S')}.xlsx",
-        media_type="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+        filename=f"{prefixo}{datetime.now().strftime('%Y%m%d_%H%M%S')}.{formato}",
+        media_type=FORMATOS_SAIDA[formato]
+    )
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def metrics():
+    """Métricas no formato de exposição do Prometheus"""
+    metrica_fila.definir(armazenamento_tarefas.tamanho_fila())
+    metrica_tarefas_ativas.definir(
+        sum(1 for estado in processing_status.values() if estado.get('status') == 'processing')
     )
+    return PlainTextResponse(metricas.exportar(), media_type="text/plain; version=0.0.4")
 
 @app.get("/health")
 async def health_check():
     """Endpoint para verificar se a API está funcionando"""
-    return {"status": "ok", "timestamp": datetime.now().isoformat()}
+    return {
+        "status": "ok",
+        "timestamp": datetime.now().isoformat(),
+        "disjuntor": "aberto" if disjuntor.aberto else "fechado",
+        "loop": monitor_loop.resumo(),
+        "cache": await em_executor(cache_buscas.contagem_por_estado)
+    }
 
 if __name__ == "__main__":
-    import uvicorn
-    uvicorn.run(app, host="0.0.0.0", port=8000)
+    import argparse
+    
+    parser = argparse.ArgumentParser(description="Processador de Bibliografia")
+    subcomandos = parser.add_subparsers(dest="comando")
+    parser_worker = subcomandos.add_parser("worker", help="Processa tarefas da fila compartilhada")
+    parser_worker.add_argument("--processos", type=int, default=os.cpu_count() or 1,
+                               help="Número de processos worker")
+    parser_lote = subcomandos.add_parser("lote", help="Processa vários arquivos sem passar pela API")
+    parser_lote.add_argument("entradas", nargs="+", help="Arquivos, diretórios ou padrões glob")
+    parser_lote.add_argument("--saida", default=PROCESSED_DIR, help="Diretório dos arquivos processados")
+    parser_lote.add_argument("--processos", type=int, default=os.cpu_count() or 1,
+                             help="Processos que leem, classificam e gravam as planilhas")
+    parser_lote.add_argument("--formato", choices=list(FORMATOS_SAIDA), default="xlsx")
+    parser_lote.add_argument("--delta", action="store_true", help="Grava só as linhas e colunas alteradas")
+    parser_catalogo = subcomandos.add_parser("importar-catalogo", help="Importa um dump bibliográfico no catálogo local")
+    parser_catalogo.add_argument("arquivos", nargs="*", help="Arquivos CSV ou JSONL")
+    parser_catalogo.add_argument("--cache", action="store_true",
+                                 help="Também indexa todos os resultados bem-sucedidos do cache")
+    args = parser.parse_args()
+    
+    if args.comando == "worker":
+        iniciar_workers(args.processos)
+    elif args.comando == "lote":
+        inicio = time.monotonic()
+        concluidos = executar_lote(args.entradas, args.saida, args.processos, args.formato, args.delta)
+        registros = sum(stats['total'] for _, _, stats, erro in concluidos if not erro)
+        erros = sum(1 for *_, erro in concluidos if erro)
+        print(f"{len(concluidos)} arquivos ({erros} com erro), {registros} registros "
+              f"em {time.monotonic() - inicio:.1f}s")
+    elif args.comando == "importar-catalogo":
+        catalogo = catalogo_local or CatalogoLocal(CATALOGO_DB)
+        for arquivo in args.arquivos:
+            print(f"{arquivo}: {catalogo.importar(arquivo)} registros novos")
+        if args.cache:
+            print(f"cache: {catalogo.adicionar(cache_buscas.resultados_encontrados())} registros novos")
+        print(f"Catálogo com {len(catalogo)} registros")
+    else:
+        import uvicorn
+        uvicorn.run(app, host="0.0.0.0", port=8000)
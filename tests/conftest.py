@@ -0,0 +1,13 @@
+import os
+import sys
+import tempfile
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, RAIZ)
+sys.path.insert(0, os.path.join(RAIZ, 'benchmarks'))
+
+# Configuração lida por main.py na importação: sem catálogo local e retentativas curtas
+os.environ.update(CATALOGO_LOCAL='0', MAX_TENTATIVAS='2', BACKOFF_BASE='0.01')
+
+# main.py cria uploads/, processed/ e cache/ no diretório atual
+os.chdir(tempfile.mkdtemp(prefix='testes_bibliografia_'))
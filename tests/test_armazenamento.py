@@ -0,0 +1,108 @@
+"""Fila de tarefas, checkpoints, concessões e estados do cache em SQLite"""
+import time
+
+import pandas as pd
+import pytest
+
+import main
+
+@pytest.fixture
+def armazenamento(tmp_path):
+    return main.ArmazenamentoTarefas(str(tmp_path / 'tarefas.db'))
+
+@pytest.fixture
+def cache(tmp_path):
+    return main.CacheBuscas(str(tmp_path / 'cache.db'), max_falhas=3)
+
+def enfileirar(armazenamento, *task_ids):
+    for task_id in task_ids:
+        armazenamento.criar(task_id, f"{task_id}.xlsx", {'status': 'queued'})
+        time.sleep(0.001)
+
+def ttl_restante(cache, chave):
+    return cache.conn.execute("SELECT expira_em FROM buscas WHERE chave = ?", (chave,)).fetchone()[0] - time.time()
+
+def test_reivindica_na_ordem_de_chegada_uma_vez_cada(armazenamento):
+    enfileirar(armazenamento, 'a', 'b')
+
+    assert armazenamento.reivindicar('w1') == ('a', 'a.xlsx')
+    assert armazenamento.reivindicar('w2') == ('b', 'b.xlsx')
+    assert armazenamento.reivindicar('w1') is None
+    assert armazenamento.tamanho_fila() == 0
+
+def test_tarefa_sem_renovacao_e_retomada_por_outro_worker(armazenamento):
+    enfileirar(armazenamento, 'a')
+    armazenamento.reivindicar('w1')
+    time.sleep(0.05)
+
+    assert armazenamento.reivindicar('w2', timeout=1) is None
+    armazenamento.renovar(['a'])
+    time.sleep(0.05)
+    assert armazenamento.reivindicar('w2', timeout=0.02) == ('a', 'a.xlsx')
+
+def test_liberar_devolve_a_fila_so_as_tarefas_do_worker(armazenamento):
+    enfileirar(armazenamento, 'a', 'b', 'c')
+    armazenamento.reivindicar('w1')
+    armazenamento.reivindicar('w2')
+
+    armazenamento.liberar('w1')
+
+    assert armazenamento.tamanho_fila() == 2
+    assert armazenamento.posicao_fila('a') == 1
+    assert armazenamento.posicao_fila('b') is None
+    assert armazenamento.reivindicar('w3') == ('a', 'a.xlsx')
+
+def test_checkpoint_retoma_os_lotes_gravados(armazenamento):
+    enfileirar(armazenamento, 'a')
+    lote = pd.DataFrame({'Título': ['Cálculo', 'Tese'], 'Número de folhas': [120, None]}, dtype=object)
+
+    armazenamento.salvar_lote('a', 0, lote, {'status': 'processing', 'progress': 50}, 2, {'total': 2})
+    tarefa = armazenamento.obter('a')
+
+    assert tarefa['lotes_concluidos'] == 1 and tarefa['processados'] == 2
+    assert tarefa['stats'] == {'total': 2} and tarefa['estado']['progress'] == 50
+    retomado = armazenamento.carregar_lote('a', 0)
+    assert retomado['Título'].tolist() == ['Cálculo', 'Tese']
+    assert retomado.loc[0, 'Número de folhas'] == 120
+
+    armazenamento.finalizar('a', {'status': 'completed'})
+    assert armazenamento.obter('a')['lotes_concluidos'] == 0
+
+def test_concessao_exclusiva_ate_expirar(armazenamento):
+    assert armazenamento.obter_concessao('revalidacao', 'w1', 0.05)
+    assert not armazenamento.obter_concessao('revalidacao', 'w2', 0.05)
+    assert armazenamento.obter_concessao('revalidacao', 'w1', 0.05)
+
+    time.sleep(0.1)
+    assert armazenamento.obter_concessao('revalidacao', 'w2', 0.05)
+
+def test_ttl_por_estado_do_cache(cache):
+    cache.salvar('encontrado', {'titulo_google': 'X'})
+    cache.salvar('ausente', None)
+    cache.salvar('falha', None, estado=main.FALHA)
+
+    assert ttl_restante(cache, 'encontrado') == pytest.approx(main.CACHE_TTL, abs=5)
+    assert ttl_restante(cache, 'ausente') == pytest.approx(main.CACHE_TTL_NAO_ENCONTRADO, abs=5)
+    assert ttl_restante(cache, 'falha') == pytest.approx(main.CACHE_TTL_FALHA, abs=5)
+    assert cache.contagem_por_estado() == {main.ENCONTRADO: 1, main.NAO_ENCONTRADO: 1, main.FALHA: 1}
+
+def test_falhas_seguidas_recuam_e_viram_nao_encontrado(cache):
+    ttls = []
+    for _ in range(3):
+        cache.salvar('k', None, estado=main.FALHA, titulo='Livro', autor='Autor')
+        ttls.append(ttl_restante(cache, 'k'))
+    assert ttls == pytest.approx([main.CACHE_TTL_FALHA * 2 ** n for n in range(3)], abs=5)
+
+    cache.salvar('k', None, estado=main.FALHA, titulo='Livro', autor='Autor')
+    assert cache.contagem_por_estado() == {main.NAO_ENCONTRADO: 1}
+    assert cache.falhas(10) == []
+
+def test_falhas_mais_antigas_primeiro_e_so_as_vencidas(cache):
+    cache.salvar('recente', None, estado=main.FALHA, titulo='Recente')
+    cache.salvar('antiga', None, ttl=10, estado=main.FALHA, titulo='Antiga')
+    cache.salvar('expirada', None, ttl=0.01, estado=main.FALHA, titulo='Expirada')
+    time.sleep(0.05)
+
+    assert cache.obter('expirada') == (False, None)
+    assert [chave for chave, _, _ in cache.falhas(10)] == ['expirada', 'antiga', 'recente']
+    assert [chave for chave, _, _ in cache.falhas(10, time.time() + 60)] == ['expirada', 'antiga']
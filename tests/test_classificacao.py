@@ -0,0 +1,72 @@
+"""Classificação linha a linha e em lote devem dar o mesmo tipo de citação"""
+import json
+
+import pandas as pd
+import pytest
+
+import main
+from bench_classificacao import gerar_volumes
+
+REGRAS_ARQUIVO = {
+    'tipo_citacao': {
+        'academico': ['Relatório técnico', 'thesis'],
+        'revista': ['periódico', 'Journal'],
+        'capitulo': [],
+    },
+    'lei': {'lei': ['lei', 'instrução normativa']},
+    'limite_paginas_artigo': 100,
+}
+
+VOLUMES_EXTRAS = [
+    {'title': 'Relatório técnico de saneamento', 'description': '', 'categories': [], 'pageCount': 80},
+    {'title': 'Anais', 'description': '', 'categories': ['Periódico de engenharia'], 'pageCount': 80},
+    {'title': 'Chapter 2', 'description': 'A JOURNAL reprint', 'categories': ['Journal'], 'pageCount': 99},
+]
+
+def classificar_em_lote(motor, volumes):
+    return motor.classificar_volumes(
+        pd.Series([v['title'] for v in volumes]),
+        pd.Series([v['description'] for v in volumes]),
+        pd.Series([', '.join(v['categories']) for v in volumes]),
+        pd.Series([v['pageCount'] for v in volumes]),
+    ).tolist()
+
+def classificar_por_linha(motor, volumes):
+    return [
+        motor.classificar_volume(v['title'].lower(), v['description'].lower(), v['categories'], v['pageCount'])
+        for v in volumes
+    ]
+
+def carregar_do_arquivo(pasta):
+    caminho = pasta / 'regras.json'
+    caminho.write_text(json.dumps(REGRAS_ARQUIVO, ensure_ascii=False), encoding='utf-8')
+    return main.MotorClassificacao.carregar(str(caminho))
+
+@pytest.fixture(params=['padrao', 'arquivo'])
+def motor(request, tmp_path):
+    if request.param == 'padrao':
+        return main.MotorClassificacao.carregar()
+    return carregar_do_arquivo(tmp_path)
+
+def test_lote_e_linha_a_linha_concordam(motor):
+    volumes = gerar_volumes(2000) + VOLUMES_EXTRAS
+
+    por_linha = classificar_por_linha(motor, volumes)
+
+    assert classificar_em_lote(motor, volumes) == por_linha
+    assert len(set(por_linha)) >= 3
+
+def test_regras_do_arquivo_sobrepoem_as_padrao(tmp_path):
+    padrao = main.MotorClassificacao.carregar()
+    do_arquivo = carregar_do_arquivo(tmp_path)
+
+    assert classificar_por_linha(padrao, VOLUMES_EXTRAS) == ['Livro', 'Livro', 'Capítulo de livro']
+    assert classificar_por_linha(do_arquivo, VOLUMES_EXTRAS) == ['Trabalho acadêmico', 'Artigo', 'Artigo']
+
+def test_leis_escalar_e_vetorizado_concordam(motor):
+    titulos = ['Lei nº 8.666, de 1993', 'Instrução normativa 12', 'Código civil comentado', 'Cálculo I', '']
+
+    marcados = motor.marcar_leis(pd.Series(titulos).str.lower()).tolist()
+
+    assert marcados == [motor.eh_lei(titulo.lower()) for titulo in titulos]
+    assert marcados[0] and not marcados[3]
@@ -0,0 +1,109 @@
+"""Fila justa entre tarefas (EscalonadorJusto) e buscas simultâneas da mesma chave (single-flight)"""
+import asyncio
+import itertools
+
+import pytest
+
+import main
+
+_titulos = itertools.count()
+
+class ProvedorContado(main.ProvedorMetadados):
+    """Provedor falso que demora `latencia` segundos e conta as buscas recebidas"""
+    nome = "contado"
+
+    def __init__(self, latencia=0.1):
+        self.latencia = latencia
+        self.buscas = 0
+
+    async def buscar(self, titulo, autor=None):
+        self.buscas += 1
+        await asyncio.sleep(self.latencia)
+        return {'titulo_google': titulo, 'autores': autor or ''}
+
+@pytest.fixture(autouse=True)
+def limitador_folgado(tmp_path, monkeypatch):
+    """Balde de tokens próprio e folgado: os testes medem a ordem, não a taxa"""
+    monkeypatch.setattr(main, 'limitador_taxa', main.LimitadorTaxa(str(tmp_path / 'limite.db'), 1000, 1000))
+
+@pytest.fixture
+def provedor(monkeypatch):
+    provedor = ProvedorContado()
+    monkeypatch.setattr(main, 'provedor_metadados', provedor)
+    return provedor
+
+def titulo_inedito():
+    """Título que ainda não está no cache compartilhado pelos testes"""
+    return f"Livro de teste {next(_titulos)}"
+
+def ordem_de_atendimento(pedidos, pesos=None):
+    """Tarefas na ordem em que o escalonador (uma vaga) liberou os `pedidos`"""
+    escalonador = main.EscalonadorJusto(limite=1)
+    for tarefa, peso in (pesos or {}).items():
+        escalonador.definir_peso(tarefa, peso)
+    ordem = []
+
+    async def pedir(tarefa):
+        await escalonador.adquirir(tarefa)
+        ordem.append(tarefa)
+        await asyncio.sleep(0)
+        escalonador.liberar()
+
+    async def executar():
+        await asyncio.gather(*(pedir(tarefa) for tarefa in pedidos))
+
+    asyncio.run(executar())
+    return ordem
+
+def test_tarefas_com_o_mesmo_peso_se_alternam():
+    # A grande chegou antes, mas a pequena não espera ela terminar
+    assert ordem_de_atendimento(['grande'] * 4 + ['pequena'] * 2) == [
+        'grande', 'pequena', 'grande', 'pequena', 'grande', 'grande'
+    ]
+
+def test_peso_maior_recebe_mais_vezes():
+    ordem = ordem_de_atendimento(['a'] * 4 + ['b'] * 4, pesos={'a': 1.0, 'b': 2.0})
+
+    assert ordem == ['a', 'b', 'b', 'a', 'b', 'b', 'a', 'a']
+
+def test_limite_de_buscas_em_andamento():
+    escalonador = main.EscalonadorJusto(limite=2)
+
+    async def executar():
+        pedidos = [asyncio.create_task(escalonador.adquirir('t')) for _ in range(3)]
+        await asyncio.sleep(0.1)
+        liberados = sum(pedido.done() for pedido in pedidos)
+        situacao = escalonador.situacao('t')
+        escalonador.liberar()
+        await asyncio.wait_for(asyncio.gather(*pedidos), timeout=1)
+        return liberados, situacao
+
+    liberados, situacao = asyncio.run(executar())
+    assert liberados == 2
+    assert situacao == {'buscas_aguardando': 1, 'posicao_escalonador': 1}
+
+def test_buscas_simultaneas_da_mesma_chave_consultam_uma_vez(provedor):
+    titulo = titulo_inedito()
+
+    async def executar():
+        return await asyncio.gather(*(main.buscar_info_livro_async(titulo, 'Autor') for _ in range(5)))
+
+    resultados = asyncio.run(executar())
+
+    assert provedor.buscas == 1
+    assert all(resultado['titulo_google'] == titulo for resultado in resultados)
+    assert main.cache_buscas.obter(main.chave_busca(titulo, 'Autor'))[0]
+
+def test_cancelar_quem_iniciou_nao_cancela_as_demais(provedor):
+    titulo = titulo_inedito()
+
+    async def executar():
+        primeira = asyncio.create_task(main.buscar_info_livro_async(titulo))
+        await asyncio.sleep(0.01)
+        segunda = asyncio.create_task(main.buscar_info_livro_async(titulo))
+        await asyncio.sleep(0.01)
+        primeira.cancel()
+        return await segunda
+
+    assert asyncio.run(executar())['titulo_google'] == titulo
+    assert provedor.buscas == 1
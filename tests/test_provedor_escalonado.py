@@ -0,0 +1,141 @@
+"""Buscas escalonadas (ProvedorEscalonado) contra dois servidores locais com atrasos injetados"""
+import asyncio
+import time
+
+import pytest
+
+import main
+from servidor_mock import CAMINHO_OPEN_LIBRARY, CAMINHO_VOLUMES, iniciar_em_thread
+
+ATRASO = 0.2
+
+class ProvedorObservado(main.ProvedorMetadados):
+    """Envolve um provedor registrando se a busca terminou ou foi cancelada"""
+
+    def __init__(self, provedor):
+        self.provedor = provedor
+        self.nome = provedor.nome
+        self.concluido = False
+        self.cancelado = False
+
+    async def buscar(self, titulo, autor=None):
+        try:
+            resultado = await self.provedor.buscar(titulo, autor)
+        except asyncio.CancelledError:
+            self.cancelado = True
+            raise
+        self.concluido = True
+        return resultado
+
+@pytest.fixture
+def servidores():
+    criados = []
+
+    def criar(**opcoes):
+        servidor, url = iniciar_em_thread(retry_after=0, **opcoes)
+        criados.append(servidor)
+        return servidor, url
+
+    yield criar
+    for servidor in criados:
+        servidor.shutdown()
+        servidor.server_close()
+
+@pytest.fixture
+def escalonado(servidores):
+    """ProvedorEscalonado(Google -> Open Library), cada um com o seu servidor mock"""
+
+    def criar(primario, secundario, caminho_primario=CAMINHO_VOLUMES, caminho_secundario=CAMINHO_OPEN_LIBRARY):
+        mock_primario, url_primario = servidores(**primario)
+        mock_secundario, url_secundario = servidores(**secundario)
+        google = ProvedorObservado(main.GoogleBooksProvedor(url_primario + caminho_primario))
+        open_library = ProvedorObservado(main.OpenLibraryProvedor(url_secundario + caminho_secundario))
+        provedor = main.ProvedorEscalonado([google, open_library], atraso=ATRASO)
+        return provedor, google, open_library, mock_secundario
+
+    return criar
+
+def buscar(provedor):
+    """(resultado, segundos) de uma busca em um event loop novo"""
+    async def executar():
+        inicio = time.monotonic()
+        try:
+            return await provedor.buscar('Introdução à economia', 'SILVA, Ana'), time.monotonic() - inicio
+        finally:
+            await main.fechar_cliente_http()
+    return asyncio.run(executar())
+
+def test_primario_lento_perde_para_o_secundario(escalonado):
+    provedor, google, open_library, _ = escalonado({'latencia': 2.0}, {'latencia': 0.01})
+    
+    resultado, segundos = buscar(provedor)
+    
+    assert resultado['provedor'] == 'openlibrary'
+    assert google.cancelado and not google.concluido
+    assert open_library.concluido
+    assert segundos < 1.0
+
+def test_primario_vazio_aciona_o_secundario_sem_esperar_o_atraso(escalonado):
+    provedor, google, open_library, _ = escalonado(
+        {'latencia': 0.01, 'proporcao_nao_encontrados': 1.0}, {'latencia': 0.01}
+    )
+    
+    resultado, segundos = buscar(provedor)
+    
+    assert resultado['provedor'] == 'openlibrary'
+    assert google.concluido and not google.cancelado
+    assert segundos < ATRASO
+
+def test_primario_rapido_vence_sem_acionar_o_secundario(escalonado):
+    provedor, google, open_library, mock_secundario = escalonado({'latencia': 0.01}, {'latencia': 0.01})
+    
+    resultado, _ = buscar(provedor)
+    
+    assert resultado['provedor'] == 'google'
+    assert google.concluido
+    assert not open_library.concluido and not open_library.cancelado
+    assert mock_secundario.estatisticas.resumo()['requisicoes'] == 0
+
+def test_ambos_lentos_vence_o_primeiro_a_responder(escalonado):
+    # O secundário começa em ATRASO e só responderia em ATRASO + 1.0: folga larga para o primário
+    provedor, google, open_library, _ = escalonado({'latencia': 0.4}, {'latencia': 1.0})
+    
+    resultado, segundos = buscar(provedor)
+    
+    assert resultado['provedor'] == 'google'
+    assert open_library.cancelado and not open_library.concluido
+    assert ATRASO < segundos < ATRASO + 1.0
+
+def test_primario_com_erro_perde_para_o_secundario(escalonado):
+    provedor, google, open_library, _ = escalonado({'latencia': 0.01, 'proporcao_429': 1.0}, {'latencia': 0.01})
+    
+    resultado, _ = buscar(provedor)
+    
+    assert resultado['provedor'] == 'openlibrary'
+    assert not google.cancelado
+
+def test_todos_com_erro_transitorio_levanta_erro_transitorio(escalonado):
+    provedor, _, _, _ = escalonado(
+        {'latencia': 0.01, 'proporcao_429': 1.0}, {'latencia': 0.01, 'proporcao_429': 1.0}
+    )
+    
+    with pytest.raises(main.ErroTransitorio):
+        buscar(provedor)
+
+def test_erro_em_um_e_vazio_no_outro_nao_levanta(escalonado):
+    provedor, _, _, _ = escalonado(
+        {'latencia': 0.01, 'proporcao_429': 1.0}, {'latencia': 0.01, 'proporcao_nao_encontrados': 1.0}
+    )
+    
+    resultado, _ = buscar(provedor)
+    
+    assert resultado is None
+
+def test_todos_com_erro_definitivo_levanta_erro_resposta(escalonado):
+    provedor, _, _, _ = escalonado(
+        {'latencia': 0.01}, {'latencia': 0.01},
+        caminho_primario='/inexistente', caminho_secundario='/inexistente'
+    )
+    
+    with pytest.raises(main.ErroResposta):
+        buscar(provedor)